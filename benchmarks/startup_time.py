@@ -0,0 +1,95 @@
+# Measures the cold import time of main.py with python -X importtime,
+# to keep track of the startup time over the releases.
+#
+# Usage:
+#   python benchmarks/startup_time.py [--runs 10] [--top 10] [--record history.jsonl --label v1.2.3] [--max-ms 100]
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List, Tuple
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+IMPORT_LINE_RE = re.compile(r"^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)$")
+
+
+def measure_once() -> Tuple[int, Dict[str, int]]:
+    """Imports main.py in a fresh interpreter.
+
+    Returns:
+        Tuple[int, Dict[str, int]]: The cumulative import time of main in microseconds,
+            and the self time of each imported module
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    total = 0
+    self_times: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE_RE.match(line)
+        if not match:
+            continue
+
+        self_us, cumulative_us, indent, module = match.groups()
+        self_times[module] = int(self_us)
+        if module == "main" and len(indent) == 1:
+            total = int(cumulative_us)
+
+    return total, self_times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold startup benchmark of main.py")
+    parser.add_argument("--runs", type=int, default=10, help="Number of runs")
+    parser.add_argument("--top", type=int, default=10, help="Slowest modules to show")
+    parser.add_argument("--record", help="JSONL file to append the result to")
+    parser.add_argument("--label", default="", help="Label of the recorded result")
+    parser.add_argument(
+        "--max-ms", type=float, help="Fail if the median import time is higher"
+    )
+    args = parser.parse_args()
+
+    totals: List[int] = []
+    module_times: Dict[str, List[int]] = {}
+    for _ in range(args.runs):
+        total, self_times = measure_once()
+        totals.append(total)
+        for module, us in self_times.items():
+            module_times.setdefault(module, []).append(us)
+
+    median_ms = statistics.median(totals) / 1000
+    print(
+        f"main.py import time: median {median_ms:.1f} ms, "
+        f"min {min(totals) / 1000:.1f} ms ({args.runs} runs)"
+    )
+
+    slowest = sorted(
+        module_times.items(), key=lambda item: statistics.median(item[1]), reverse=True
+    )
+    print("Slowest modules (self time):")
+    for module, times in slowest[: args.top]:
+        print(f"  {statistics.median(times) / 1000:8.2f} ms  {module}")
+
+    if args.record:
+        with open(args.record, "a", encoding="utf-8") as f:
+            record = {
+                "label": args.label,
+                "timestamp": int(time.time()),
+                "python": sys.version.split()[0],
+                "median_ms": median_ms,
+                "runs": args.runs,
+            }
+            f.write(json.dumps(record) + "\n")
+
+    if args.max_ms is not None and median_ms > args.max_ms:
+        print(f"Import time above the {args.max_ms} ms limit")
+        sys.exit(1)
@@ -0,0 +1,292 @@
+from pathlib import Path
+from typing import Dict, Tuple
+import os
+import json
+
+from utils import link_or_copy, safe_filename, temp_path
+from locks import FileLock
+from singleflight import SingleFlight
+from cursemaven import (
+    Transfer,
+    resolve_cdn_url,
+    filename_from_cdn_url,
+    download_mod,
+    download_file,
+)
+
+# Can be changed with the MODPACK_CACHE_DIR env variable or the --cache argument
+DEFAULT_CACHE_DIR = os.environ.get(
+    "MODPACK_CACHE_DIR", os.path.join(Path.home(), ".cache", "modpack_downloader")
+)
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+
+
+class ArtifactCache:
+    """Local on-disk store of the resolved filenames and of the downloaded files.
+    Each file is stored as <cache>/<project id>/<file id>/<filename>, next to a meta.json
+    containing what has been resolved from CurseMaven for it.
+    The cache can be shared by more processes at once: each file is downloaded by one of them
+    while the others wait for it (see lock), and files are only ever published with an atomic rename."""
+
+    def __init__(self, cache_dir: str | None = None):
+        """Set the cache folder.
+
+        Args:
+            cache_dir (str | None, optional): The cache folder. Defaults to DEFAULT_CACHE_DIR.
+        """
+        self.cache_dir: str = cache_dir or DEFAULT_CACHE_DIR
+
+        # The metas already read, so a long running process (like the daemon) doesnt read them again each time
+        self.metas: Dict[Tuple[str, str], Dict] = {}
+
+        # Shared by everything using this cache in the process (like the daemon's jobs),
+        # so the same file is resolved and downloaded once even by different modpacks
+        self.flights = SingleFlight()
+
+    def entry_folder(self, project_id: int, file_id: int) -> str:
+        """Gets the folder where the given file and its meta are stored."""
+        return os.path.join(self.cache_dir, str(project_id), str(file_id))
+
+    def file_path(self, project_id: int, file_id: int, filename: str) -> str | None:
+        """Gets where the given file is stored, checking that the filename cant point outside of its folder,
+        since it comes from the servers.
+
+        Returns:
+            str | None: The path, or None if the filename isnt usable
+        """
+        if safe_filename(filename) != filename:
+            return None
+
+        folder = os.path.abspath(self.entry_folder(project_id, file_id))
+        path = os.path.join(folder, filename)
+        return path if os.path.dirname(path) == folder else None
+
+    def lock(self, project_id: int, file_id: int) -> FileLock:
+        """Gets the lock of a file, held by the process downloading or changing it."""
+        return FileLock(os.path.join(self.entry_folder(project_id, file_id), LOCK_FILE))
+
+    def get_meta(self, project_id: int, file_id: int) -> Dict | None:
+        """Gets the cached resolution info of a file.
+
+        Args:
+            project_id (int)
+            file_id (int)
+
+        Returns:
+            Dict | None: The meta dict, or None if the file has never been resolved
+        """
+        key = (str(project_id), str(file_id))
+        meta = self.metas.get(key)
+        if meta is not None:
+            return meta
+
+        meta_path = os.path.join(self.entry_folder(project_id, file_id), META_FILE)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except:
+            return None
+
+        self.metas[key] = meta
+        return meta
+
+    def set_meta(self, project_id: int, file_id: int, meta: Dict) -> None:
+        """Atomically writes the resolution info of a file."""
+        folder = self.entry_folder(project_id, file_id)
+        os.makedirs(folder, exist_ok=True)
+
+        meta_path = os.path.join(folder, META_FILE)
+        tmp_path = temp_path(meta_path)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+        self.metas[(str(project_id), str(file_id))] = meta
+
+    def artifact_path(self, project_id: int, file_id: int) -> str | None:
+        """Gets the path of a cached file.
+
+        Args:
+            project_id (int)
+            file_id (int)
+
+        Returns:
+            str | None: The path of the file, or None if it isnt in the cache
+        """
+        meta = self.get_meta(project_id, file_id)
+        if meta is None:
+            return None
+
+        path = self.file_path(project_id, file_id, meta["filename"])
+        return path if path is not None and os.path.isfile(path) else None
+
+    def resolve(self, project_id: int, file_id: int) -> str | None:
+        """Gets the filename of a file, asking CurseMaven only if it isnt already cached.
+
+        Args:
+            project_id (int)
+            file_id (int)
+
+        Returns:
+            str | None: The filename, or None if the file isnt on CurseMaven
+        """
+        meta = self.get_meta(project_id, file_id)
+        if meta is not None:
+            return meta["filename"]
+
+        return self.flights.do(
+            ("resolve", str(project_id), str(file_id)),
+            self._resolve,
+            project_id,
+            file_id,
+        )
+
+    def _resolve(self, project_id: int, file_id: int) -> str | None:
+        meta = self.get_meta(project_id, file_id)  # Resolved by the previous flight
+        if meta is not None:
+            return meta["filename"]
+
+        cdn_url = resolve_cdn_url(project_id, file_id)
+        if not cdn_url:
+            return None
+
+        filename = safe_filename(filename_from_cdn_url(cdn_url))
+        if filename is None:
+            return None
+
+        self.set_meta(project_id, file_id, {"filename": filename, "cdn_url": cdn_url})
+        return filename
+
+    def fetch(
+        self,
+        project_id: int,
+        file_id: int,
+        filename: str | None = None,
+        url: str | None = None,
+        deadline: float | None = None,
+        transfer: Transfer | None = None,
+    ) -> str | None:
+        """Makes sure a file is in the cache, downloading it if its missing.
+        The file is written to a temporary name and then renamed, so a cached file is always complete.
+        If another thread or process is already downloading it, this waits for that one and uses its file.
+
+        Args:
+            project_id (int)
+            file_id (int)
+            filename (str | None, optional): The already known filename, to skip resolving it. Defaults to None.
+            url (str | None, optional): Direct url to download the file from instead of CurseMaven,
+                needs the filename too. Defaults to None.
+            deadline (float | None, optional): time.monotonic() value after which the download is aborted. Defaults to None.
+            transfer (Transfer | None, optional): Object to report the progress to and to check for cancellation. Defaults to None.
+
+        Returns:
+            str | None: The path of the cached file, or None if it couldnt be downloaded
+        """
+        cached = self.artifact_path(project_id, file_id)
+        if cached is not None:
+            return cached
+
+        # A hedge request uses another url, so it isnt coalesced with the request its hedging
+        fetched = self.flights.do(
+            ("fetch", str(project_id), str(file_id), url),
+            self._fetch_locked,
+            project_id,
+            file_id,
+            filename,
+            url,
+            deadline,
+            transfer,
+        )
+        # The request followed could have been cancelled because its hedge won
+        return fetched or self.artifact_path(project_id, file_id)
+
+    def _fetch_locked(
+        self,
+        project_id: int,
+        file_id: int,
+        filename: str | None,
+        url: str | None,
+        deadline: float | None,
+        transfer: Transfer | None,
+    ) -> str | None:
+        lock = self.lock(project_id, file_id)
+        should_stop = transfer.cancelled.is_set if transfer is not None else None
+        if not lock.acquire(deadline=deadline, should_stop=should_stop):
+            return None
+
+        try:
+            # Downloaded by another process while waiting for the lock
+            cached = self.artifact_path(project_id, file_id)
+            if cached is not None:
+                return cached
+
+            return self._download(
+                project_id, file_id, filename, url, deadline, transfer
+            )
+        finally:
+            lock.release()
+
+    def _download(
+        self,
+        project_id: int,
+        file_id: int,
+        filename: str | None,
+        url: str | None,
+        deadline: float | None,
+        transfer: Transfer | None,
+    ) -> str | None:
+        if filename is None:
+            filename = self.resolve(project_id, file_id)
+            if filename is None:
+                return None
+
+        path = self.file_path(project_id, file_id, filename)
+        if path is None:
+            return None
+
+        if self.get_meta(project_id, file_id) is None:
+            self.set_meta(project_id, file_id, {"filename": filename, "cdn_url": url})
+
+        tmp_path = temp_path(path)
+
+        if url is not None:
+            success = download_file(url, tmp_path, deadline, transfer)
+        else:
+            success = download_mod(
+                filename, tmp_path, project_id, file_id, deadline, transfer
+            )
+
+        if not success:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
+        os.replace(tmp_path, path)
+        return path
+
+    def add(
+        self, project_id: int, file_id: int, filename: str, path: str, url: str
+    ) -> None:
+        """Puts in the cache a file downloaded from somewhere else, so next time it doesnt need to be looked for.
+
+        Args:
+            project_id (int)
+            file_id (int)
+            filename (str): The file's name
+            path (str): The downloaded file, that is hardlinked or copied into the cache
+            url (str): Where the file has been downloaded from
+        """
+        entry_path = self.file_path(project_id, file_id, filename)
+        if entry_path is None:
+            return
+
+        with self.lock(project_id, file_id):
+            self.set_meta(project_id, file_id, {"filename": filename, "cdn_url": url})
+            link_or_copy(path, entry_path)
+
+    def evict(self, project_id: int, file_id: int) -> None:
+        """Removes a file from the cache, for example if its corrupted."""
+        with self.lock(project_id, file_id):
+            cached = self.artifact_path(project_id, file_id)
+            if cached is not None:
+                os.remove(cached)
@@ -0,0 +1,254 @@
+from typing import Dict, List, Tuple
+import os
+import sqlite3
+import concurrent.futures
+
+from modpack import Modpack, is_modpack_valid, is_mrpack
+from cache import ArtifactCache
+
+# Kept in the cache folder, the path can be changed with the --catalog argument
+CATALOG_FILE = "catalog.sqlite"
+PACK_EXTENSIONS = (".zip", ".mrpack")
+SCAN_CHUNK_SIZE = 4  # Packs sent to a scanning process at a time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    format TEXT,
+    name TEXT,
+    version TEXT,
+    author TEXT,
+    minecraft TEXT,
+    valid INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    pack_id INTEGER NOT NULL REFERENCES packs(id) ON DELETE CASCADE,
+    project_id TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    name TEXT,
+    type TEXT
+);
+CREATE INDEX IF NOT EXISTS files_by_id ON files (project_id, file_id);
+CREATE INDEX IF NOT EXISTS files_by_pack ON files (pack_id);
+"""
+
+
+def open_catalog(
+    catalog_path: str | None = None, cache_dir: str | None = None
+) -> sqlite3.Connection:
+    """Opens the catalog database, creating it if it doesnt exist.
+
+    Args:
+        catalog_path (str | None, optional): The database file. Defaults to CATALOG_FILE in the cache folder.
+        cache_dir (str | None, optional): The cache folder. Defaults to the default one of ArtifactCache.
+
+    Returns:
+        sqlite3.Connection: The connection, with the rows accessible by column name
+    """
+    catalog_path = catalog_path or os.path.join(
+        ArtifactCache(cache_dir).cache_dir, CATALOG_FILE
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(catalog_path)), exist_ok=True)
+
+    connection = sqlite3.connect(catalog_path)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def find_packs(directory: str) -> Dict[str, os.stat_result]:
+    """Finds all the modpack archives in a folder and its subfolders.
+
+    Args:
+        directory (str): The folder to search
+
+    Returns:
+        Dict[str, os.stat_result]: The absolute path of each archive, with its stat
+    """
+    packs: Dict[str, os.stat_result] = {}
+
+    for root, _, files in os.walk(os.path.abspath(directory)):
+        for name in files:
+            if name.lower().endswith(PACK_EXTENSIONS):
+                path = os.path.join(root, name)
+                packs[path] = os.stat(path)
+
+    return packs
+
+
+def scan_pack(pack_path: str) -> Dict:
+    """Reads the metadata and the file list of a modpack, run in the scanning processes.
+
+    Args:
+        pack_path (str): The modpack's ZIP or .mrpack file
+
+    Returns:
+        Dict: The pack's metadata and its files as (project id, file id, name, type),
+            with "valid" False if it isnt a modpack
+    """
+    modpack = Modpack(pack_path, "")
+    try:
+        if not is_modpack_valid(pack_path) or not modpack.load_modpack(
+            create_folders=False
+        ):
+            return {"valid": False, "files": []}
+    except:
+        return {"valid": False, "files": []}
+
+    return {
+        "valid": True,
+        "format": "modrinth" if is_mrpack(pack_path) else "curseforge",
+        "name": modpack.modpack_name,
+        "version": modpack.modpack_version,
+        "author": modpack.modpack_author,
+        "minecraft": modpack.minecraft_version,
+        "files": [
+            (
+                str(mod.project_id),
+                str(mod.file_id),
+                mod.view_name or mod.filename or None,
+                mod.file_type.name,
+            )
+            for mod in modpack
+        ],
+    }
+
+
+def update_catalog(
+    connection: sqlite3.Connection, directory: str, workers: int | None = None
+) -> Tuple[int, int, int]:
+    """Brings the catalog up to date with the modpacks in a folder, scanning in parallel
+    only the ones that are new or whose modification time or size changed.
+    The packs of the folder that dont exist anymore are removed from the catalog.
+
+    Args:
+        connection (sqlite3.Connection): The catalog, from open_catalog
+        directory (str): The folder with the modpacks
+        workers (int | None, optional): Number of scanning processes. Defaults to the number of CPUs.
+
+    Returns:
+        Tuple[int, int, int]: (scanned packs, removed packs, packs in the folder)
+    """
+    packs = find_packs(directory)
+
+    root = os.path.join(os.path.abspath(directory), "")
+    known: Dict[str, Tuple[int, int]] = {
+        row["path"]: (row["mtime_ns"], row["size"])
+        for row in connection.execute(
+            "SELECT path, mtime_ns, size FROM packs WHERE substr(path, 1, ?) = ?",
+            (len(root), root),
+        )
+    }
+
+    removed = [path for path in known if path not in packs]
+    to_scan = [
+        path
+        for path, stat in packs.items()
+        if known.get(path) != (stat.st_mtime_ns, stat.st_size)
+    ]
+
+    with connection:  # One transaction, the catalog is never half updated
+        connection.executemany(
+            "DELETE FROM packs WHERE path = ?", [(path,) for path in removed]
+        )
+
+        if to_scan:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                results = pool.map(scan_pack, to_scan, chunksize=SCAN_CHUNK_SIZE)
+
+                for path, scanned in zip(to_scan, results):
+                    _store_pack(connection, path, packs[path], scanned)
+
+    return len(to_scan), len(removed), len(packs)
+
+
+def _store_pack(
+    connection: sqlite3.Connection, path: str, stat: os.stat_result, scanned: Dict
+) -> None:
+    connection.execute("DELETE FROM packs WHERE path = ?", (path,))
+    cursor = connection.execute(
+        "INSERT INTO packs (path, mtime_ns, size, format, name, version, author, "
+        "minecraft, valid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            path,
+            stat.st_mtime_ns,
+            stat.st_size,
+            scanned.get("format"),
+            scanned.get("name"),
+            scanned.get("version"),
+            scanned.get("author"),
+            scanned.get("minecraft"),
+            int(scanned["valid"]),
+        ),
+    )
+    connection.executemany(
+        "INSERT INTO files (pack_id, project_id, file_id, name, type) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [(cursor.lastrowid, *file) for file in scanned["files"]],
+    )
+
+
+def list_packs(connection: sqlite3.Connection) -> List[sqlite3.Row]:
+    """Gets all the valid packs in the catalog, with the number of files of each one."""
+    return connection.execute(
+        "SELECT packs.*, COUNT(files.pack_id) AS files FROM packs "
+        "LEFT JOIN files ON files.pack_id = packs.id "
+        "WHERE valid = 1 GROUP BY packs.id ORDER BY path"
+    ).fetchall()
+
+
+def packs_with(
+    connection: sqlite3.Connection,
+    project_id: int | str,
+    file_id: int | str | None = None,
+) -> List[sqlite3.Row]:
+    """Finds the packs that include a project, or a specific file of it.
+
+    Args:
+        connection (sqlite3.Connection): The catalog
+        project_id (int | str): The project to search
+        file_id (int | str | None, optional): The file to search, None for any file of the project. Defaults to None.
+
+    Returns:
+        List[sqlite3.Row]: The packs, with the file_id they include
+    """
+    query = (
+        "SELECT DISTINCT packs.*, files.file_id FROM files "
+        "JOIN packs ON packs.id = files.pack_id WHERE files.project_id = ?"
+    )
+    params: List[str] = [str(project_id)]
+    if file_id is not None:
+        query += " AND files.file_id = ?"
+        params.append(str(file_id))
+
+    return connection.execute(query + " ORDER BY packs.path", params).fetchall()
+
+
+def packs_union(
+    connection: sqlite3.Connection, pack_paths: List[str]
+) -> List[sqlite3.Row]:
+    """Gets every distinct file included in at least one of the given packs.
+
+    Args:
+        connection (sqlite3.Connection): The catalog
+        pack_paths (List[str]): The packs, they need to be in the catalog
+
+    Returns:
+        List[sqlite3.Row]: The files as (project_id, file_id, name, type, packs),
+            where packs is how many of the given packs include it
+    """
+    paths = [os.path.abspath(path) for path in pack_paths]
+    placeholders = ", ".join("?" * len(paths))
+
+    return connection.execute(
+        "SELECT project_id, file_id, MAX(name) AS name, MAX(type) AS type, "
+        "COUNT(DISTINCT pack_id) AS packs FROM files "
+        f"WHERE pack_id IN (SELECT id FROM packs WHERE path IN ({placeholders})) "
+        "GROUP BY project_id, file_id "
+        "ORDER BY CAST(project_id AS INTEGER), project_id, CAST(file_id AS INTEGER)",
+        paths,
+    ).fetchall()
@@ -1,35 +1,127 @@
-import requests
+from typing import Dict
+import os
 import re
+import time
+import threading
 
-CURSEMAVEN_URL = "https://cursemaven.com"
+DEFAULT_CURSEMAVEN_URL = "https://cursemaven.com"
+# Can be pointed to a local mirror (see mirror.py) with the CURSEMAVEN_URL env variable or the --maven-url argument
+CURSEMAVEN_URL = os.environ.get("CURSEMAVEN_URL", DEFAULT_CURSEMAVEN_URL).rstrip("/")
 GROUP_PATH = "curse/maven"
 
+CONNECT_TIMEOUT = 10  # Seconds to wait for a connection
+READ_TIMEOUT = 30  # Seconds to wait for the next bytes from the server
+# Downloads slower than this for a whole STALL_WINDOW are aborted, so they can be retried. Can be changed with --min-speed
+MIN_DOWNLOAD_SPEED = 10 * 1024  # Bytes per second
+STALL_WINDOW = 20  # Seconds
+POOL_MAXSIZE = 64  # Connections kept open to each host, enough for all the download threads
 
-def mod_name_from_id(project_id: int, file_id: int) -> str | None:
-    """Get the mod name from its ID using the CurseMaven repo.
-    If a string is returned, then the project exists on CurseMaven, otherwise it doesnt exist
-    and needs to be downloaded manually
+_session = None
+_session_lock = threading.Lock()
+
+
+class Transfer:
+    """Progress of a running download, that can also be used to cancel it from another thread."""
+
+    def __init__(self):
+        self.started: float = time.monotonic()
+        self.bytes_done: int = 0
+        self.cancelled = threading.Event()
+        self.response = None  # The response being read, interrupted by cancel()
+        self.response_lock = threading.Lock()
+
+        # Set once the server responds, used to check what has been downloaded
+        self.url: str | None = None  # After the redirects
+        self.headers: Dict[str, str] = {}  # With lowercase names
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def speed(self) -> float:
+        """Gets the average download speed in bytes per second."""
+        return self.bytes_done / max(self.elapsed(), 1e-3)
+
+    def attach(self, response) -> bool:
+        """Sets the response being read, or None once done with it (before its connection goes back to the pool).
+
+        Returns:
+            bool: False if the transfer has already been cancelled
+        """
+        with self.response_lock:
+            self.response = response
+            return not self.cancelled.is_set()
+
+    def cancel(self) -> None:
+        """Cancels the download, interrupting the read in progress even if the server stopped sending."""
+        with self.response_lock:
+            self.cancelled.set()
+            if self.response is None:
+                return
+
+            import socket
+
+            # Closing the response would wait for the read, shutting down the socket makes it fail at once
+            try:
+                self.response.raw.connection.sock.shutdown(socket.SHUT_RDWR)
+            except:
+                pass
+
+
+def get_session():
+    """Gets the HTTP session shared by all the requests, so that the connections (and their TLS handshakes)
+    are reused across the mods, and across the jobs when running as a daemon.
+
+    Returns:
+        requests.Session: The shared session
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            import requests  # Imported when needed, to keep the startup fast
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_MAXSIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+
+        return _session
+
+
+def resolve_cdn_url(project_id: int, file_id: int) -> str | None:
+    """Asks the CurseMaven repo where the file is actually hosted.
 
     Args:
         project_id (int)
         file_id (int)
 
     Returns:
-        str | None: The project's name
+        str | None: The CDN url of the file, or None if the file isnt on CurseMaven
     """
     maven_url = f"{CURSEMAVEN_URL}/test/{project_id}/{file_id}"
 
-    resp = requests.get(maven_url)
-    cdn_url = None
+    resp = get_session().get(maven_url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
     for line in resp.text.splitlines():
         if line.startswith("Found: "):
-            cdn_url = line[len("Found: ") :]
-            break
+            return line[len("Found: ") :]
 
-    if not cdn_url:
-        return None
+    return None
+
+
+def filename_from_cdn_url(cdn_url: str) -> str:
+    """Gets the real filename of a file hosted on the CDN.
 
-    response = requests.head(cdn_url, allow_redirects=True)
+    Args:
+        cdn_url (str): The url returned by resolve_cdn_url
+
+    Returns:
+        str: The filename, from the content-disposition header if present, otherwise from the url
+    """
+    response = get_session().head(
+        cdn_url, allow_redirects=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+    )
     cd = response.headers.get("content-disposition")
     if cd:
         fname = re.findall('filename="?([^"]+)"?', cd)
@@ -38,31 +130,133 @@ def mod_name_from_id(project_id: int, file_id: int) -> str | None:
     return cdn_url.split("/")[-1]
 
 
-def download_mod(name: str, save_path: str, project_id: int, file_id: int) -> bool:
-    """Downloads a mod to the given path from its IDs using the CurseMaven repo
+def mod_name_from_id(project_id: int, file_id: int) -> str | None:
+    """Get the mod name from its ID using the CurseMaven repo.
+    If a string is returned, then the project exists on CurseMaven, otherwise it doesnt exist
+    and needs to be downloaded manually
+
+    Args:
+        project_id (int)
+        file_id (int)
+
+    Returns:
+        str | None: The project's name
+    """
+    cdn_url = resolve_cdn_url(project_id, file_id)
+    if not cdn_url:
+        return None
+
+    return filename_from_cdn_url(cdn_url)
+
+
+def maven_jar_url(name: str, project_id: int, file_id: int) -> str:
+    """Builds the maven url of a file.
 
     Args:
         name (str): The mod name, can be whatever is accepted by CurseMaven and usually isnt important.
-        save_path (str): The path to the file that will be created.
         project_id (int)
         file_id (int)
 
     Returns:
-        bool: True if the mod has successfully been downloaded, False otherwise
+        str: The url of the jar on CurseMaven
     """
     artifact_id = f"{name}-{project_id}"
     version = str(file_id)
 
-    url = f"{CURSEMAVEN_URL}/{GROUP_PATH}/{artifact_id}/{version}/{artifact_id}-{version}.jar"
+    return f"{CURSEMAVEN_URL}/{GROUP_PATH}/{artifact_id}/{version}/{artifact_id}-{version}.jar"
+
+
+def download_file(
+    url: str,
+    save_path: str,
+    deadline: float | None = None,
+    transfer: Transfer | None = None,
+) -> bool:
+    """Downloads a file to the given path.
+    The download is aborted if it stalls (see MIN_DOWNLOAD_SPEED), if the deadline is reached or if it gets cancelled.
+
+    Args:
+        url (str): The file url
+        save_path (str): The path to the file that will be created.
+        deadline (float | None, optional): time.monotonic() value after which the download is aborted. Defaults to None.
+        transfer (Transfer | None, optional): Object to report the progress to and to check for cancellation. Defaults to None.
+
+    Returns:
+        bool: True if the file has successfully been downloaded, False otherwise
+    """
+    read_timeout = READ_TIMEOUT
+    if deadline is not None:  # Dont wait for the server past the deadline
+        read_timeout = max(min(read_timeout, deadline - time.monotonic()), 0.1)
 
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
+        with get_session().get(
+            url, stream=True, timeout=(CONNECT_TIMEOUT, read_timeout)
+        ) as response:
+            if transfer is not None and not transfer.attach(response):
+                return False  # Cancelled before the server responded
+            try:
+                response.raise_for_status()
+
+                if transfer is not None:
+                    transfer.url = response.url
+                    transfer.headers = {
+                        k.lower(): v for k, v in response.headers.items()
+                    }
+
+                window_start = time.monotonic()
+                window_bytes = 0
+
+                with open(save_path, "wb") as f:
+                    # read1 returns what has arrived instead of waiting for a full chunk, so slow downloads are noticed
+                    while chunk := response.raw.read1(8192, decode_content=True):
+                        f.write(chunk)
+                        window_bytes += len(chunk)
 
-        with open(save_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+                        if transfer is not None:
+                            transfer.bytes_done += len(chunk)
+                            if transfer.cancelled.is_set():
+                                return False
 
-        return True
+                        now = time.monotonic()
+                        if deadline is not None and now > deadline:
+                            return False
+
+                        elapsed = now - window_start
+                        if elapsed >= STALL_WINDOW:
+                            if window_bytes / elapsed < MIN_DOWNLOAD_SPEED:
+                                return False  # Stalled, the caller can retry
+                            window_start = now
+                            window_bytes = 0
+
+                return True
+            finally:
+                if transfer is not None:
+                    transfer.attach(None)
     except:
         return False
+
+
+def download_mod(
+    name: str,
+    save_path: str,
+    project_id: int,
+    file_id: int,
+    deadline: float | None = None,
+    transfer: Transfer | None = None,
+) -> bool:
+    """Downloads a mod to the given path from its IDs using the CurseMaven repo
+
+    Args:
+        name (str): The mod name, can be whatever is accepted by CurseMaven and usually isnt important.
+        save_path (str): The path to the file that will be created.
+        project_id (int)
+        file_id (int)
+        deadline (float | None, optional): time.monotonic() value after which the download is aborted. Defaults to None.
+        transfer (Transfer | None, optional): Object to report the progress to and to check for cancellation. Defaults to None.
+
+    Returns:
+        bool: True if the mod has successfully been downloaded, False otherwise
+    """
+    return download_file(
+        maven_jar_url(name, project_id, file_id), save_path, deadline, transfer
+    )
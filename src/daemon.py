@@ -0,0 +1,378 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from typing import Dict, List
+from print_color import print
+import os
+import re
+import json
+import time
+import uuid
+import threading
+import concurrent.futures
+
+from cache import ArtifactCache
+from modpack import is_modpack_valid
+from modpack_download import (
+    DOWNLOAD_THREADS,
+    DownloadMonitor,
+    extract_modpack,
+    export_modpack,
+    prefetch_modpack,
+    retry_failed,
+)
+from failures import failures_path
+from export import archive_error
+from staging import carry_over, prepare_staging, swap_staging, wait_instance_lock
+
+MAX_JOBS = 4  # Jobs running at the same time, the others wait in the queue
+JOB_TYPES = ["install", "update", "swap", "prefetch", "retry", "export"]
+FINISHED_STATES = ["done", "failed", "cancelled"]
+
+JOB_PATH_RE = re.compile(r"^/jobs/(?P<id>[0-9a-f]+)/?$")
+
+
+class Job:
+    """A job requested to the daemon (one of JOB_TYPES), with its state and progress."""
+
+    def __init__(self, job_type: str, params: Dict, monitor: DownloadMonitor):
+        """Creates a queued job.
+
+        Args:
+            job_type (str): One of JOB_TYPES
+            params (Dict): The request's parameters, see DaemonServer.run_job
+            monitor (DownloadMonitor): Follows the job's downloads
+        """
+        self.id: str = uuid.uuid4().hex[:12]
+        self.type = job_type
+        self.params = params
+        self.monitor = monitor
+        self.future: concurrent.futures.Future | None = None
+
+        self.state: str = "queued"  # queued, running, done, failed or cancelled
+        self.error: str | None = None
+        self.created: float = time.time()
+        self.started: float | None = None
+        self.finished: float | None = None
+
+    def target(self) -> str | None:
+        """Gets the folder (or archive) the job writes to, two jobs cant run on the same one."""
+        return self.params.get("path") or self.params.get("export")
+
+    def to_dict(self) -> Dict:
+        with self.monitor.lock:
+            total, done, failed = (
+                self.monitor.total,
+                self.monitor.done,
+                self.monitor.failed,
+            )
+
+        return {
+            "id": self.id,
+            "type": self.type,
+            "state": self.state,
+            "modpack": self.params.get("modpack"),
+            "path": self.params.get("path"),
+            "export": self.params.get("export"),
+            "total": total,
+            "done": done,
+            "failed": failed,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class DaemonServer(ThreadingHTTPServer):
+    """Local HTTP server that runs the install jobs in a long running process, so the HTTP connections,
+    the cache and the imports stay warm between them.
+    All the jobs' downloads go through the same thread pool, so running many jobs doesnt multiply the threads.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, cache: ArtifactCache | None, max_jobs: int = MAX_JOBS):
+        super().__init__(address, DaemonRequestHandler)
+        self.cache = cache
+
+        self.downloads_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=DOWNLOAD_THREADS
+        )
+        self.jobs_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_jobs)
+
+        self.jobs_lock = threading.Lock()
+        self.jobs: Dict[str, Job] = {}
+
+    def submit(self, job_type: str, params: Dict) -> Job:
+        """Queues a new job.
+
+        Args:
+            job_type (str): One of JOB_TYPES
+            params (Dict): The request's parameters
+
+        Raises:
+            ValueError: If the request isnt valid
+            FileExistsError: If another job is already writing to the same folder
+
+        Returns:
+            Job: The queued job
+        """
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"Unknown job type, must be one of {JOB_TYPES}")
+
+        params = dict(params)
+        for key in ["modpack", "path", "lock", "writeLock", "export"]:
+            if params.get(key):  # The daemon can run from any folder
+                params[key] = os.path.abspath(params[key])
+
+        if job_type not in ["retry", "swap"]:
+            if not params.get("modpack") or not is_modpack_valid(params["modpack"]):
+                raise ValueError("Missing or invalid modpack")
+        needs_path = job_type in ["install", "update", "swap", "retry"]
+        if needs_path and not params.get("path"):
+            raise ValueError("Missing path")
+        if job_type in ["prefetch", "export"] and self.cache is None:
+            raise ValueError("Prefetching and exporting need the cache")
+        if job_type == "export" and not params.get("export"):
+            raise ValueError("Missing export")
+        if params.get("export") and (error := archive_error(params["export"])):
+            raise ValueError(error)
+        if job_type == "retry" and not os.path.exists(failures_path(params["path"])):
+            raise ValueError("No failed mods list in this folder")
+
+        job = Job(job_type, params, DownloadMonitor(self.downloads_executor))
+
+        with self.jobs_lock:
+            target = job.target()
+            for other in self.jobs.values():
+                if (
+                    target is not None
+                    and other.target() == target
+                    and other.state not in FINISHED_STATES
+                ):
+                    raise FileExistsError(f"Job {other.id} is already using this path")
+
+            self.jobs[job.id] = job
+            job.future = self.jobs_executor.submit(self.run_job, job)
+
+        return job
+
+    def cancel(self, job: Job) -> None:
+        """Cancels a job, if queued its removed from the queue, if running its downloads are stopped."""
+        with self.jobs_lock:
+            if job.state in FINISHED_STATES:
+                return
+
+            if job.future is not None and job.future.cancel():
+                job.state = "cancelled"
+                job.finished = time.time()
+                return
+
+        job.monitor.cancel()
+
+    def run_job(self, job: Job) -> None:
+        """Runs a job, called in the jobs' thread pool.
+        The parameters are the same as the command line ones:
+        modpack, path, side, lock, writeLock, deadline, hedge, export and (for updates) swap, to also put the staged install in place."""
+        job.state = "running"
+        job.started = time.time()
+
+        params = job.params
+        deadline: float | None = params.get("deadline")
+        hedge: bool = params.get("hedge", True)
+
+        instance_lock = None
+        try:
+            # Other processes (like a cron install) can be using the same folder
+            if params.get("path"):
+                instance_lock = wait_instance_lock(
+                    params["path"], lambda: job.monitor.cancelled
+                )
+
+            if instance_lock is None and params.get("path"):
+                result = None  # Cancelled while waiting
+            elif job.type == "prefetch":
+                assert self.cache is not None
+                result = prefetch_modpack(
+                    params["modpack"], self.cache, None, job.monitor
+                )
+
+            elif job.type == "export":
+                assert self.cache is not None
+                result = export_modpack(
+                    params["modpack"],
+                    params["export"],
+                    self.cache,
+                    params.get("side", "client"),
+                    None,
+                    job.monitor,
+                )
+                if result is None:
+                    job.error = "Error loading the modpack or downloading some of its mods"
+
+            elif job.type == "swap":
+                result = True if swap_staging(params["path"]) else None
+                if result is None:
+                    job.error = "Nothing staged for this folder"
+
+            elif job.type == "retry":
+                result = retry_failed(
+                    params["path"], self.cache, deadline, hedge, None, job.monitor
+                )
+
+            else:
+                live_path: str = params["path"]
+                install_path = live_path
+                if job.type == "update":
+                    install_path = prepare_staging(live_path)
+
+                result = extract_modpack(
+                    params["modpack"],
+                    install_path,
+                    self.cache,
+                    params.get("lock"),
+                    params.get("writeLock"),
+                    deadline,
+                    hedge,
+                    params.get("side", "client"),
+                    live_path if job.type == "update" else None,
+                    None,
+                    job.monitor,
+                    params.get("export"),
+                )
+
+                if result is not None and job.type == "update":
+                    if os.path.isdir(live_path):
+                        carry_over(live_path, install_path)
+                    if params.get("swap", False) and not job.monitor.cancelled:
+                        swap_staging(live_path)
+
+            if job.monitor.cancelled:
+                job.state = "cancelled"
+            elif result is None:
+                job.state = "failed"
+                job.error = job.error or "Error loading the job's files"
+            else:
+                job.state = "done"
+        except Exception as e:
+            job.state = "failed"
+            job.error = str(e) or type(e).__name__
+        finally:
+            if instance_lock is not None:
+                instance_lock.release()
+            job.finished = time.time()
+
+        print(
+            f"{job.id} ({job.type}): {job.state}",
+            tag="Job finished",
+            tag_color="g" if job.state == "done" else "r",
+            color="w",
+        )
+
+    def list_jobs(self) -> List[Dict]:
+        with self.jobs_lock:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def get_job(self, job_id: str) -> Job | None:
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    server: DaemonServer
+
+    def log_message(self, format, *args):
+        pass  # Keep the console clean
+
+    def _send_json(self, code: int, data) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, code: int, message: str) -> None:
+        self._send_json(code, {"error": message})
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+
+        if path.rstrip("/") == "/jobs":
+            self._send_json(200, {"jobs": self.server.list_jobs()})
+        elif match := JOB_PATH_RE.match(path):
+            job = self.server.get_job(match["id"])
+            if job is None:
+                self._send_error(404, "No such job")
+            else:
+                self._send_json(200, job.to_dict())
+        else:
+            self._send_error(404, "Not found")
+
+    def do_POST(self):
+        if urlsplit(self.path).path.rstrip("/") != "/jobs":
+            self._send_error(404, "Not found")
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+            job_type = request.pop("type")
+        except:
+            self._send_error(400, 'Expected a JSON object with a "type"')
+            return
+
+        try:
+            job = self.server.submit(job_type, request)
+        except ValueError as e:
+            self._send_error(400, str(e))
+            return
+        except FileExistsError as e:
+            self._send_error(409, str(e))
+            return
+
+        print(
+            f"{job.id} ({job.type}): {job.params.get('modpack') or job.params.get('path')}",
+            tag="Job queued",
+            tag_color="c",
+            color="w",
+        )
+        self._send_json(201, job.to_dict())
+
+    def do_DELETE(self):
+        match = JOB_PATH_RE.match(urlsplit(self.path).path)
+        job = self.server.get_job(match["id"]) if match else None
+        if job is None:
+            self._send_error(404, "No such job")
+            return
+
+        self.server.cancel(job)
+        self._send_json(200, job.to_dict())
+
+
+def serve_daemon(
+    host: str, port: int, cache: ArtifactCache | None, max_jobs: int = MAX_JOBS
+) -> None:
+    """Runs the daemon until interrupted.
+
+    Args:
+        host (str): The address to listen on, the API can install anywhere so it should stay local
+        port (int): The port to listen on
+        cache (ArtifactCache | None): The cache shared by all the jobs
+        max_jobs (int, optional): Jobs running at the same time. Defaults to MAX_JOBS.
+    """
+    with DaemonServer((host, port), cache, max_jobs) as server:
+        print(
+            f"http://{host}:{port} ({max_jobs} jobs at a time)",
+            tag="Daemon listening on",
+            tag_color="c",
+            color="w",
+        )
+        print("Press Ctrl+C to stop", color="m")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            for job in list(server.jobs.values()):
+                server.cancel(job)
+            server.jobs_executor.shutdown(wait=True)
+            server.downloads_executor.shutdown(wait=False, cancel_futures=True)
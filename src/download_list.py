@@ -1,7 +1,6 @@
 from typing import List, Tuple
 from modpack import Modpack
 from mod import ModElement, mod_type_html_map
-from jinja2 import Template
 from print_color import print
 from utils import ask_yes_no
 from suppress_std import SuppressStd
@@ -75,6 +74,8 @@ def ask_download_list(modpack: Modpack, error_list: List[int]) -> None:
     ):
         return
 
+    from jinja2 import Template  # Only needed here, when some mods failed
+
     # List that will be rendered as HTML
     # List[ ( (type, color), (name, url) ) ]
     render_list: List[Tuple[Tuple[str, str], Tuple[str, str]]] = []
@@ -0,0 +1,345 @@
+from typing import BinaryIO, Dict, List, Set, Tuple
+import os
+import io
+import time
+import queue
+import threading
+import shutil
+import tarfile
+import zipfile
+
+from modpack import Modpack
+from utils import temp_path
+
+ZIP_MIN_MTIME = 315532800  # 1980-01-01, the oldest date in ZIP files
+# Timestamp of every archive member, so that the same install always gives the same archive
+ARCHIVE_MTIME = int(os.environ.get("SOURCE_DATE_EPOCH", ZIP_MIN_MTIME))
+ARCHIVE_FILE_MODE = 0o644
+# Files already compressed, stored as they are in ZIP archives
+STORED_EXTENSIONS = (".jar", ".zip", ".mrpack", ".png", ".ogg")
+
+ARCHIVE_FORMATS = [".zip", ".tar", ".tar.gz", ".tgz", ".tar.xz", ".tar.zst", ".tzst"]
+
+
+def archive_format(path: str) -> str | None:
+    """Gets the format of an archive from its extension.
+
+    Args:
+        path (str): The archive path
+
+    Returns:
+        str | None: One of ARCHIVE_FORMATS, or None if the extension isnt supported
+    """
+    name = path.lower()
+    for extension in sorted(ARCHIVE_FORMATS, key=len, reverse=True):
+        if name.endswith(extension):
+            return extension
+    return None
+
+
+def archive_error(path: str) -> str | None:
+    """Checks if an archive can be written, before starting the install.
+
+    Args:
+        path (str): The archive path
+
+    Returns:
+        str | None: Why the archive cant be written, or None if it can
+    """
+    archive_type = archive_format(path)
+    if archive_type is None:
+        return f"Unsupported archive format, use one of {ARCHIVE_FORMATS}"
+
+    if archive_type in [".tar.zst", ".tzst"]:
+        import importlib.util
+
+        if importlib.util.find_spec("zstandard") is None:
+            return "The zstandard package is needed for .tar.zst archives (pip install zstandard)"
+
+    return None
+
+
+def override_members(
+    zip_path: str, subfolders: List[str]
+) -> Dict[str, zipfile.ZipInfo]:
+    """Lists the files that extracting the overrides folders would create (see extract_zip_subfolder).
+    When more folders have the same file, the one in the last folder is used, like when extracting them.
+
+    Args:
+        zip_path (str): The modpack's ZIP file
+        subfolders (List[str]): The overrides folders inside the ZIP
+
+    Returns:
+        Dict[str, zipfile.ZipInfo]: The paths relative to the output folder, with the ZIP member of each one
+    """
+    members: Dict[str, zipfile.ZipInfo] = {}
+    if not subfolders or not zipfile.is_zipfile(zip_path):
+        return members
+
+    with zipfile.ZipFile(zip_path, "r") as z:
+        infos = z.infolist()
+
+    for subfolder in subfolders:
+        subfolder = subfolder.strip("/")
+        for info in infos:
+            member = info.filename
+            if member.endswith("/"):
+                continue
+
+            if subfolder == "." or member.startswith(subfolder + "/"):
+                name = member if subfolder == "." else member[len(subfolder) + 1 :]
+                members[name] = info
+
+    return members
+
+
+class ArchiveWriter:
+    """Writes the members of a ZIP or tar archive one after the other, with fixed metadata.
+    The archive is written to a temporary file and renamed to its path only when closed successfully."""
+
+    def __init__(self, path: str):
+        """Creates the archive.
+
+        Args:
+            path (str): The archive path, its extension chooses the format (see ARCHIVE_FORMATS)
+
+        Raises:
+            ValueError: If the format isnt supported
+            ModuleNotFoundError: If the format is tar.zst and the zstandard package isnt installed
+        """
+        self.path = path
+        self.format = archive_format(path)
+        if self.format is None:
+            raise ValueError(
+                f"Unsupported archive format, use one of {ARCHIVE_FORMATS}"
+            )
+
+        self.tmp_path = temp_path(path)
+        self.file: BinaryIO = open(self.tmp_path, "wb")
+        self.stream: BinaryIO | None = None  # Compressor between tarfile and the file
+        self.zip: zipfile.ZipFile | None = None
+        self.tar: tarfile.TarFile | None = None
+
+        try:
+            if self.format == ".zip":
+                self.zip = zipfile.ZipFile(self.file, "w")
+                return
+
+            if self.format in [".tar.gz", ".tgz"]:
+                import gzip
+
+                # No filename and mtime in the header, they would change the archive
+                self.stream = gzip.GzipFile(
+                    filename="", mode="wb", fileobj=self.file, mtime=0
+                )
+            elif self.format == ".tar.xz":
+                import lzma
+
+                self.stream = lzma.LZMAFile(self.file, "wb")
+            elif self.format in [".tar.zst", ".tzst"]:
+                import zstandard  # Optional, only needed for this format
+
+                self.stream = zstandard.ZstdCompressor().stream_writer(
+                    self.file, closefd=False
+                )
+
+            self.tar = tarfile.open(
+                fileobj=self.stream or self.file, mode="w|", format=tarfile.PAX_FORMAT
+            )
+        except:
+            self.abort()
+            raise
+
+    def add_file(self, name: str, source: BinaryIO, size: int) -> None:
+        """Adds a file to the archive, copying it from a stream.
+
+        Args:
+            name (str): The path inside the archive, with / separators
+            source (BinaryIO): The file content
+            size (int): The content size in bytes
+        """
+        if self.zip is not None:
+            date_time = time.gmtime(max(ARCHIVE_MTIME, ZIP_MIN_MTIME))[:6]
+            info = zipfile.ZipInfo(name, date_time=date_time)
+            info.external_attr = ARCHIVE_FILE_MODE << 16
+            info.compress_type = (
+                zipfile.ZIP_STORED
+                if name.lower().endswith(STORED_EXTENSIONS)
+                else zipfile.ZIP_DEFLATED
+            )
+            info.file_size = size
+            with self.zip.open(info, "w", force_zip64=size > 0x7FFFFFFF) as target:
+                shutil.copyfileobj(source, target)
+            return
+
+        assert self.tar is not None
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = ARCHIVE_MTIME
+        info.mode = ARCHIVE_FILE_MODE
+        info.uid = info.gid = 0
+        info.uname = info.gname = ""
+        self.tar.addfile(info, source)
+
+    def add_bytes(self, name: str, data: bytes) -> None:
+        """Adds a file to the archive from its content."""
+        self.add_file(name, io.BytesIO(data), len(data))
+
+    def close(self) -> None:
+        """Finishes the archive and moves it to its path."""
+        if self.zip is not None:
+            self.zip.close()
+        if self.tar is not None:
+            self.tar.close()
+        if self.stream is not None:
+            self.stream.close()
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        """Closes and removes the unfinished archive."""
+        # Closed before the file, or they would try again to write into it when collected
+        for archive in [self.zip, self.tar, self.stream]:
+            if archive is not None:
+                try:
+                    archive.close()
+                except:
+                    pass
+
+        try:
+            self.file.close()
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+
+class ArchiveExporter:
+    """Callback for multithreaded_download that adds each mod to an archive as soon as its downloaded,
+    while the others are still downloading, instead of packing the instance folder after the install.
+    The mods are added in the modpack's order (waiting for the earlier ones when needed), then the overrides
+    sorted by path, then the other files, so the same modpack always gives the same archive.
+    The archive is written by its own thread, so compressing big files doesnt slow down the downloads."""
+
+    def __init__(self, modpack: Modpack, path: str, from_cache: bool = False):
+        """Creates the archive.
+
+        Args:
+            modpack (Modpack): The Modpack instance, the archive's layout is the one of its output folder
+            path (str): The archive path, its extension chooses the format (see ARCHIVE_FORMATS)
+            from_cache (bool, optional): Whether the mods are taken from the cache instead of the output folder,
+                when they are only prefetched. Defaults to False.
+        """
+        self.modpack = modpack
+        self.from_cache = from_cache
+        self.writer = ArchiveWriter(path)
+
+        self.finished: Dict[int, bool] = {}  # Mod index -> downloaded
+        self.next_index = 0
+        self.written: Set[str] = set()
+
+        # The overrides are extracted after the mods, so they replace the mods with the same path
+        self.overrides = override_members(modpack.modpack_path, modpack.overrides)
+
+        # The downloads' results, added to the archive by the writer thread
+        self.results: queue.Queue[Tuple[int, int | None] | None] = queue.Queue()
+        self.error: BaseException | None = None
+        self.thread = threading.Thread(target=self._write_results, daemon=True)
+        self.thread.start()
+
+    def __call__(self, mod_index: int, error: int | None) -> None:
+        self.results.put((mod_index, error))
+
+    def _write_results(self) -> None:
+        while (result := self.results.get()) is not None:
+            if self.error is not None:
+                continue  # Keep emptying the queue, the archive will be aborted
+
+            mod_index, error = result
+            self.finished[mod_index] = error is None
+            try:
+                while self.next_index in self.finished:
+                    if self.finished[self.next_index]:
+                        self._add_mod(self.next_index)
+                    self.next_index += 1
+            except BaseException as e:
+                self.error = e
+
+    def _stop_thread(self) -> None:
+        if self.thread.is_alive():
+            self.results.put(None)
+            self.thread.join()
+
+    def _finish_results(self) -> None:
+        """Waits for the writer thread to add the mods downloaded until now, raising its eventual error."""
+        self._stop_thread()
+        if self.error is not None:
+            raise self.error
+
+        while not self.results.empty():  # Given after the thread stopped, added by the caller
+            result = self.results.get()
+            if result is not None:
+                self.finished[result[0]] = result[1] is None
+
+    def _add_mod(self, mod_index: int) -> None:
+        mod_element = self.modpack[mod_index]
+
+        source_path: str | None = None
+        if self.from_cache:
+            assert self.modpack.cache is not None
+            source_path = self.modpack.cache.artifact_path(
+                mod_element.project_id, mod_element.file_id
+            )
+            if source_path is None:
+                return
+            if not mod_element.filename:  # Prefetching doesnt set it
+                mod_element.filename = os.path.basename(source_path)
+
+        path = self.modpack.target_path(mod_element)
+        name = os.path.relpath(path, self.modpack.output_path or ".")
+        name = name.replace(os.sep, "/")
+        if name in self.written or name in self.overrides:
+            return  # Duplicate of an already added file, or replaced by an override
+
+        with open(source_path or path, "rb") as source:
+            self.writer.add_file(name, source, os.fstat(source.fileno()).st_size)
+        self.written.add(name)
+
+    def _add_remaining_mods(self) -> None:
+        """Adds the downloaded mods still waiting for an earlier one that didnt finish,
+        and the ones found later (like from the fallback sources)."""
+        self._finish_results()
+        for mod_index in sorted(self.finished):
+            if self.finished[mod_index]:
+                self._add_mod(mod_index)  # The ones already added are skipped
+        self.next_index = len(self.modpack)
+
+    def add_overrides(self) -> None:
+        """Adds the overrides straight from the modpack's ZIP, without reading them back from the output folder."""
+        self._add_remaining_mods()
+        if not self.overrides:
+            return
+
+        with zipfile.ZipFile(self.modpack.modpack_path, "r") as z:
+            for name in sorted(self.overrides):
+                if name in self.written:
+                    continue
+
+                info = self.overrides[name]
+                with z.open(info) as source:
+                    self.writer.add_file(name, source, info.file_size)
+                self.written.add(name)
+
+    def add_bytes(self, name: str, data: bytes) -> None:
+        """Adds a generated file, like the readme."""
+        self._finish_results()
+        self.writer.add_bytes(name, data)
+        self.written.add(name)
+
+    def close(self) -> None:
+        """Finishes the archive."""
+        self._add_remaining_mods()
+        self.writer.close()
+
+    def abort(self) -> None:
+        self._stop_thread()
+        self.writer.abort()
@@ -0,0 +1,100 @@
+from typing import Dict, List, Tuple
+import os
+import json
+
+from modpack import Modpack
+from mod import ModElement
+from utils import temp_path
+
+FAILED_MODS_FILE = "failed_mods.json"
+FAILED_MODS_VERSION = 1
+
+DEFAULT_FAILURE_REASON = "download didnt finish"
+
+
+def failures_path(extraction_path: str) -> str:
+    """Gets the path of the failed mods list of an instance folder.
+
+    Args:
+        extraction_path (str): The instance folder
+
+    Returns:
+        str: The path of the list, that might not exist
+    """
+    return os.path.join(extraction_path, FAILED_MODS_FILE)
+
+
+def write_failures(modpack: Modpack, error_indices: List[int]) -> None:
+    """Saves in the modpack's folder the mods that couldnt be downloaded, with the reason,
+    so that the retry command can download only those later.
+    If nothing failed an eventual old list is removed.
+
+    Args:
+        modpack (Modpack): The Modpack instance, after downloading the mods
+        error_indices (List[int]): The indices of the mods that couldnt be downloaded
+    """
+    path = failures_path(modpack.output_path)
+
+    if not error_indices:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+
+    # Duplicates of a file are saved once, keeping the one that got further in the resolution
+    files: Dict[Tuple, Dict] = {}
+
+    for error_idx in error_indices:
+        mod_element = modpack[error_idx]
+        key = (mod_element.project_id, mod_element.file_id, mod_element.target_folder)
+        if key in files and files[key]["filename"]:
+            continue
+
+        file = mod_element.to_dict()
+        file["reason"] = modpack.failures.get(error_idx, DEFAULT_FAILURE_REASON)
+        files[key] = file
+
+    failures = {
+        "failedModsVersion": FAILED_MODS_VERSION,
+        "modpack": os.path.abspath(modpack.modpack_path),
+        "name": modpack.modpack_name,
+        "version": modpack.modpack_version,
+        "side": modpack.side,
+        "directUrls": modpack.use_direct_urls,
+        "files": list(files.values()),
+    }
+
+    tmp_path = temp_path(path)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(failures, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_failures(modpack: Modpack) -> bool:
+    """Replaces the modpack's files with the ones that failed in the last run in its folder.
+
+    Args:
+        modpack (Modpack): The Modpack instance, whose output path is the instance folder
+
+    Returns:
+        bool: True if the list has been loaded successfully, False otherwise.
+    """
+    try:
+        with open(failures_path(modpack.output_path), encoding="utf-8") as f:
+            failures = json.load(f)
+
+        if failures.get("failedModsVersion") != FAILED_MODS_VERSION:
+            return False
+
+        mods: List[ModElement] = [
+            ModElement.from_dict(file) for file in failures["files"]
+        ]
+    except:
+        return False
+
+    modpack.modpack_path = failures.get("modpack", "")
+    modpack.modpack_name = failures.get("name", "")
+    modpack.modpack_version = failures.get("version", "")
+    modpack.side = failures.get("side", modpack.side)
+    modpack.use_direct_urls = failures.get("directUrls", False)
+    modpack.mods = mods
+    return True
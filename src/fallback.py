@@ -0,0 +1,271 @@
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import quote, unquote, urlsplit
+from string import Formatter
+import os
+import re
+import zipfile
+import concurrent.futures
+
+from modpack import Modpack
+from mod import ModElement
+from cursemaven import Transfer, download_file
+from utils import print_progress, safe_filename, temp_path
+from failures import DEFAULT_FAILURE_REASON
+
+# Same link as Modpack.generate_download_url, the one of the manual download page
+CURSEFORGE_SOURCE = "{curseforge_url}/download/{file_id}"
+# Extra url templates to try, separated by spaces. Can be set with the MODPACK_FALLBACK_SOURCES env variable
+# or with --fallback, and disabled with --no-fallback (see url_from_template for the placeholders)
+FALLBACK_SOURCES: List[str] = [CURSEFORGE_SOURCE] + os.environ.get(
+    "MODPACK_FALLBACK_SOURCES", ""
+).split()
+
+# What the servers send instead of the file, like login or error pages
+REJECTED_CONTENT_TYPES = ["text/html", "text/plain", "application/json"]
+
+FALLBACK_THREADS = (os.cpu_count() or 1) * 5
+
+FallbackSource = Callable[[ModElement], str | None]
+
+
+def url_from_template(template: str, mod_element: ModElement) -> str | None:
+    """Builds the url of a file from a template, with the placeholders:
+    {project_id}, {file_id}, {file_id_head} and {file_id_tail} (the file ID split like in the CurseForge CDN urls,
+    4707050 -> 4707 and 50), {filename} (when resolved) and {curseforge_url} (when the modpack has a modlist).
+
+    Args:
+        template (str): The url template
+        mod_element (ModElement): The mod to download
+
+    Returns:
+        str | None: The url, or None if the mod doesnt have something needed by the template
+    """
+    values: Dict[str, str] = {
+        "project_id": str(mod_element.project_id),
+        "file_id": str(mod_element.file_id),
+    }
+    if str(mod_element.file_id).isdigit():
+        values["file_id_head"] = str(int(mod_element.file_id) // 1000)
+        values["file_id_tail"] = str(int(mod_element.file_id) % 1000)
+    if mod_element.filename:
+        values["filename"] = quote(mod_element.filename)
+    if mod_element.curseforge_url:
+        values["curseforge_url"] = mod_element.curseforge_url.rstrip("/")
+
+    fields = [field for _, field, _, _ in Formatter().parse(template) if field]
+    if any(field not in values for field in fields):
+        return None
+
+    return template.format(**values)
+
+
+def template_sources(templates: List[str]) -> List[FallbackSource]:
+    """Makes the sources of a list of url templates (see url_from_template)."""
+    return [
+        lambda mod_element, template=template: url_from_template(template, mod_element)
+        for template in templates
+    ]
+
+
+def filename_from_transfer(transfer: Transfer) -> str | None:
+    """Gets the name of a downloaded file, from the content-disposition header if present, otherwise from the url.
+
+    Args:
+        transfer (Transfer): The finished download
+
+    Returns:
+        str | None: The filename, or None if there isnt a usable one
+    """
+    filename = None
+
+    disposition = transfer.headers.get("content-disposition")
+    if disposition:
+        found = re.findall('filename="?([^";]+)"?', disposition)
+        if found:
+            filename = unquote(found[0])
+
+    if not filename and transfer.url:
+        filename = unquote(urlsplit(transfer.url).path.split("/")[-1])
+
+    return safe_filename(filename or "")
+
+
+def is_valid_download(
+    modpack: Modpack, mod_element: ModElement, transfer: Transfer, path: str
+) -> bool:
+    """Checks that a fallback source sent the actual file and not some page in its place.
+
+    Args:
+        modpack (Modpack): The Modpack instance
+        mod_element (ModElement): The downloaded mod
+        transfer (Transfer): The finished download, with the response headers
+        path (str): The downloaded file
+
+    Returns:
+        bool: True if the file looks right, False otherwise
+    """
+    content_type = transfer.headers.get("content-type", "").split(";")[0].strip()
+    if content_type.lower() in REJECTED_CONTENT_TYPES:
+        return False
+
+    content_length = transfer.headers.get("content-length")
+    encoded = transfer.headers.get("content-encoding", "identity") != "identity"
+    if content_length is not None and not encoded:
+        if int(content_length) != os.path.getsize(path):
+            return False  # Truncated
+
+    # Mods, resourcepacks and shaderpacks are all ZIP files
+    if not zipfile.is_zipfile(path):
+        return False
+
+    return modpack.verify_file(mod_element, path)
+
+
+def fallback_resource(
+    modpack: Modpack, mod_index: int, sources: List[FallbackSource]
+) -> bool:
+    """Tries to download a mod from the fallback sources, one after the other.
+
+    Args:
+        modpack (Modpack): The Modpack instance
+        mod_index (int): The mod index
+        sources (List[FallbackSource]): Functions giving the url of a mod in each source, or None
+
+    Returns:
+        bool: True if the mod has been downloaded, False otherwise
+    """
+    mod_element: ModElement = modpack[mod_index]
+
+    for source in sources:
+        url = source(mod_element)
+        if url is None or modpack.time_left() == 0:
+            continue
+
+        key = ("fallback", mod_index)
+        transfer = Transfer()
+        with modpack.transfers_lock:  # So that Modpack.stop cancels it
+            modpack.transfers.setdefault(key, []).append(transfer)
+            modpack.transfer_elements[key] = mod_element
+
+        # The filename is known only after the download, so it's saved in the output folder first
+        tmp_path = temp_path(os.path.join(modpack.output_path, "fallback"))
+        try:
+            if not download_file(url, tmp_path, modpack.deadline, transfer):
+                continue
+            if not is_valid_download(modpack, mod_element, transfer, tmp_path):
+                continue
+
+            filename = mod_element.filename or filename_from_transfer(transfer)
+            if filename is None:
+                continue
+
+            mod_element.filename = filename
+            mod_element.cdn_url = transfer.url or url
+
+            download_filepath = modpack.target_path(mod_element)
+            os.makedirs(os.path.dirname(download_filepath), exist_ok=True)
+            os.replace(tmp_path, download_filepath)
+
+            if modpack.cache is not None:  # So next time it's found without looking for it
+                try:
+                    modpack.cache.add(
+                        mod_element.project_id,
+                        mod_element.file_id,
+                        filename,
+                        download_filepath,
+                        mod_element.cdn_url,
+                    )
+                except:
+                    pass  # The file is installed anyway
+            return True
+        except:
+            continue
+        finally:
+            with modpack.transfers_lock:
+                del modpack.transfers[key]
+                del modpack.transfer_elements[key]
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return False
+
+
+def fallback_download(
+    modpack: Modpack,
+    error_indices: List[int],
+    sources: List[FallbackSource] | None = None,
+    show_progress: bool = True,
+    executor: concurrent.futures.ThreadPoolExecutor | None = None,
+) -> List[int]:
+    """Tries to download concurrently from the fallback sources all the mods that couldnt be downloaded.
+
+    Args:
+        modpack (Modpack): The Modpack instance, after downloading the mods
+        error_indices (List[int]): The indices of the mods that couldnt be downloaded
+        sources (List[FallbackSource] | None, optional): The sources to try for each mod, in order.
+            Defaults to the templates in FALLBACK_SOURCES.
+        show_progress (bool, optional): Whether to print the progress bar. Defaults to True.
+        executor (concurrent.futures.ThreadPoolExecutor | None, optional): Runs the downloads, like the one
+            shared by the daemon's jobs. Defaults to None, to use a new one.
+
+    Returns:
+        List[int]: The indices of the mods that couldnt be downloaded from any source
+    """
+    if sources is None:
+        sources = template_sources(FALLBACK_SOURCES)
+
+    if not sources or not error_indices:
+        return list(error_indices)
+
+    # The duplicates of a file are downloaded once
+    duplicates: Dict[Tuple, List[int]] = {}
+    for mod_index in error_indices:
+        mod_element = modpack[mod_index]
+        key = (mod_element.project_id, mod_element.file_id, mod_element.target_folder)
+        duplicates.setdefault(key, []).append(mod_index)
+
+    still_failed: List[int] = []
+
+    own_executor = executor is None
+    if executor is None:
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(FALLBACK_THREADS, len(duplicates))
+        )
+
+    futures: Dict[concurrent.futures.Future, List[int]] = {}
+    try:
+        futures = {
+            executor.submit(fallback_resource, modpack, indices[0], sources): indices
+            for indices in duplicates.values()
+        }
+
+        done_count = 0
+        for future in concurrent.futures.as_completed(futures):
+            indices = futures[future]
+            downloaded = future.result()
+            first = modpack[indices[0]]
+
+            for mod_index in indices:
+                if downloaded:
+                    modpack[mod_index].filename = first.filename
+                    modpack[mod_index].cdn_url = first.cdn_url
+                    modpack.failures.pop(mod_index, None)
+                else:
+                    still_failed.append(mod_index)
+                    reason = modpack.failures.get(mod_index, DEFAULT_FAILURE_REASON)
+                    modpack.failures[mod_index] = f"{reason}, not in the fallback sources"
+
+            done_count += 1
+            if show_progress:
+                print_progress(done_count, len(futures))
+    except KeyboardInterrupt:
+        modpack.stop()
+        raise
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+        else:  # Shared with other jobs, only this one's downloads are cancelled
+            for future in futures:
+                future.cancel()
+
+    return sorted(still_failed)
@@ -0,0 +1,107 @@
+from typing import Dict, List
+import os
+import json
+
+from modpack import Modpack
+from mod import ModElement
+from utils import file_hashes, temp_path
+
+LOCKFILE_VERSION = 1
+LOCK_HASH_ALGORITHM = "sha256"
+
+
+def write_lockfile(modpack: Modpack, lock_path: str, error_indices: List[int]) -> None:
+    """Writes a lockfile with everything that has been resolved for the modpack's downloaded files,
+    so that later installs can skip the resolution and verify what they download.
+    The mods that couldnt be downloaded are written unresolved, so installing from the lockfile
+    tries to resolve them again and reports them if they still fail, instead of leaving them out.
+
+    Args:
+        modpack (Modpack): The Modpack instance, after downloading the mods
+        lock_path (str): Path of the lockfile to write
+        error_indices (List[int]): The indices of the mods that couldnt be downloaded
+    """
+    failed = set(error_indices)
+    written = set()
+    files: List[Dict] = []
+
+    for idx, mod_element in enumerate(modpack):
+        if idx in failed:
+            key = ("failed", mod_element.project_id, mod_element.file_id)
+            if key not in written:
+                written.add(key)
+                files.append(unresolved_file(mod_element))
+            continue
+
+        key = modpack.download_key(mod_element)
+        if key in written:
+            continue
+
+        path = modpack.target_path(mod_element)
+        written.add(key)
+
+        file = mod_element.to_dict()
+        file["size"] = os.path.getsize(path)
+        file["hashes"] = file_hashes(path, [LOCK_HASH_ALGORITHM])
+        file["folder"] = os.path.relpath(
+            os.path.dirname(path), modpack.output_path
+        ).replace(os.sep, "/")
+        files.append(file)
+
+    lock = {
+        "lockfileVersion": LOCKFILE_VERSION,
+        "name": modpack.modpack_name,
+        "version": modpack.modpack_version,
+        "author": modpack.modpack_author,
+        "minecraft": modpack.minecraft_version,
+        "files": files,
+    }
+
+    tmp_path = temp_path(lock_path)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(lock, f, indent=2)
+    os.replace(tmp_path, lock_path)
+
+
+def unresolved_file(mod_element: ModElement) -> Dict:
+    """Gets the lockfile entry of a mod that couldnt be downloaded.
+    The files of Modrinth modpacks keep what their index says, the others keep only their IDs,
+    since whatever was resolved for them might be what made them fail.
+
+    Args:
+        mod_element (ModElement): The failed mod
+
+    Returns:
+        Dict: The entry, without filename, url, size and hashes if they arent from the modpack
+    """
+    file = mod_element.to_dict()
+    if not mod_element.direct_urls:
+        file.update({"filename": None, "url": None, "size": None, "hashes": {}})
+    return file
+
+
+def load_lockfile(modpack: Modpack, lock_path: str) -> bool:
+    """Replaces the modpack's files with the ones in the lockfile, already resolved.
+    They will be downloaded directly from their recorded url and verified against their hashes.
+
+    Args:
+        modpack (Modpack): The loaded Modpack instance
+        lock_path (str): Path of the lockfile
+
+    Returns:
+        bool: True if the lockfile has been loaded successfully, False otherwise.
+    """
+    try:
+        with open(lock_path, "r", encoding="utf-8") as f:
+            lock = json.load(f)
+
+        if lock.get("lockfileVersion") != LOCKFILE_VERSION:
+            return False
+
+        mods: List[ModElement] = [ModElement.from_dict(file) for file in lock["files"]]
+    except:
+        return False
+
+    modpack.mods = mods
+    modpack.use_direct_urls = True
+    return True
@@ -0,0 +1,123 @@
+from typing import BinaryIO, Callable, Dict, List
+import os
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_POLL_INTERVAL = 0.1  # Seconds between the attempts to take a lock held by another process
+
+# Locks held by this process, by path, with how many times each one has been acquired
+_held_lock = threading.Lock()
+_held: Dict[str, List] = {}
+
+
+def _try_lock(file: BinaryIO) -> bool:
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(file: BinaryIO) -> None:
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+        file.close()
+
+
+class FileLock:
+    """Advisory lock on a file, to coordinate more installers running at once on the same cache or folder.
+    It's held by one process at a time, while the threads of that process share it:
+    they are coordinated by the SingleFlight of whoever uses the lock, like ArtifactCache.flights,
+    which still lets a hedge request download the same file from another url.
+    The OS releases it if the process dies, so a crashed install never leaves it stuck.
+    The lock file is never removed, removing it while another process waits on it would break the lock."""
+
+    def __init__(self, path: str):
+        """Set the lock file.
+
+        Args:
+            path (str): The lock file path, created when first acquired
+        """
+        self.path = os.path.abspath(path)
+        self.locked = False
+
+    def acquire(
+        self,
+        blocking: bool = True,
+        deadline: float | None = None,
+        should_stop: Callable[[], bool] | None = None,
+    ) -> bool:
+        """Takes the lock, waiting for the other process holding it to release it.
+
+        Args:
+            blocking (bool, optional): Whether to wait, if False the lock is tried only once. Defaults to True.
+            deadline (float | None, optional): time.monotonic() value after which it stops waiting. Defaults to None.
+            should_stop (Callable[[], bool] | None, optional): Checked while waiting, to stop waiting
+                when it returns True, like when the download is cancelled. Defaults to None.
+
+        Returns:
+            bool: True if the lock has been taken, False otherwise
+        """
+        if self.locked:
+            return True
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        while True:
+            with _held_lock:
+                held = _held.get(self.path)
+                if held is not None:  # Already held by another thread of this process
+                    held[1] += 1
+                    self.locked = True
+                    return True
+
+                file = open(self.path, "a+b")
+                if _try_lock(file):
+                    _held[self.path] = [file, 1]
+                    self.locked = True
+                    return True
+                file.close()
+
+            if not blocking:
+                return False
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            if should_stop is not None and should_stop():
+                return False
+
+            time.sleep(LOCK_POLL_INTERVAL)
+
+    def release(self) -> None:
+        """Releases the lock, if taken."""
+        if not self.locked:
+            return
+
+        self.locked = False
+        with _held_lock:
+            held = _held[self.path]
+            held[1] -= 1
+            if held[1] == 0:
+                del _held[self.path]
+                _unlock(held[0])
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
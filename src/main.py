@@ -9,9 +9,32 @@ from utils import (
     set_windows_dpi_awareness,
 )
 from modpack import is_modpack_valid, get_minecraft_version_wrapper
-from modpack_download import extract_modpack
+from modpack_download import (
+    extract_modpack,
+    export_modpack,
+    prefetch_modpack,
+    retry_failed,
+)
+from cache import ArtifactCache
+from failures import failures_path
+from staging import (
+    carry_over,
+    prepare_staging,
+    swap_staging,
+    rollback,
+    wait_instance_lock,
+)
+import cursemaven
+import fallback
+import os
 
 if __name__ == "__main__":
+    # Needed by the catalog's scanning processes in the built executable
+    if getattr(sys, "frozen", False):
+        import multiprocessing
+
+        multiprocessing.freeze_support()
+
     set_windows_dpi_awareness()  # Get correct dialog window scaling in windows
 
     print("Curseforge modpack downloader", color="green", format="underline")
@@ -19,24 +42,398 @@ if __name__ == "__main__":
 
     ############### Arg parser ###############
 
+    # Options accepted both before and after the command name
+    common_parser = argparse.ArgumentParser(
+        add_help=False, argument_default=argparse.SUPPRESS
+    )
+    common_parser.add_argument(
+        "--maven-url",
+        help="CurseMaven url to use, for example a local mirror (default: $CURSEMAVEN_URL or https://cursemaven.com)",
+    )
+    common_parser.add_argument(
+        "--cache",
+        help="Path to the cache folder (default: $MODPACK_CACHE_DIR or ~/.cache/modpack_downloader)",
+    )
+    common_parser.add_argument(
+        "--min-speed",
+        type=float,
+        help="Retry downloads slower than this many KB/s (default: 10)",
+    )
+    common_parser.add_argument(
+        "--results",
+        help="JSON lines file where the result of each mod is appended as soon as it's done",
+    )
+    common_parser.add_argument(
+        "--fallback",
+        action="append",
+        help="Url template of another source to try for the mods that couldnt be downloaded, can be repeated. "
+        "Placeholders: {project_id}, {file_id}, {file_id_head}, {file_id_tail}, {filename}, {curseforge_url}",
+    )
+    common_parser.add_argument(
+        "--no-fallback",
+        action="store_true",
+        help="Dont try to download the missing mods from the fallback sources",
+    )
+    common_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Download the files directly, without using the cache",
+    )
+    common_parser.add_argument(
+        "--no-hedge",
+        action="store_true",
+        help="Dont start a second request for the slowest downloads",
+    )
+    common_parser.add_argument(
+        "--deadline",
+        type=float,
+        help="Time limit in seconds for the downloads, after which the install continues with what has been downloaded",
+    )
+
     parser = argparse.ArgumentParser(
         description="Simple program to manually download CurseForge modpacks.",
+        parents=[common_parser],
     )
 
-    parser.add_argument("-f", "--file", help="Path to the modpack's ZIP file")
+    parser.add_argument(
+        "-f",
+        "--file",
+        help="Path to the modpack's ZIP file (CurseForge) or .mrpack file (Modrinth)",
+    )
     parser.add_argument(
         "-p", "--path", help="Path where the modpack will be downloaded"
     )
+    parser.add_argument(
+        "--lock",
+        help="Install the files recorded in this lockfile, skipping their resolution",
+    )
+    parser.add_argument(
+        "--write-lock", help="Write a lockfile of the installed files to this path"
+    )
+    parser.add_argument(
+        "--side",
+        choices=["client", "server"],
+        default="client",
+        help="Side to install Modrinth modpacks for (default: client)",
+    )
+    parser.add_argument(
+        "--staged",
+        action="store_true",
+        help="Install into a staging folder next to the selected one, reusing its unchanged files, "
+        "to put it in place later with the swap command",
+    )
+    parser.add_argument(
+        "--export",
+        help="Also write the installed modpack to this archive (.zip, .tar, .tar.gz, .tar.xz or .tar.zst) while downloading it",
+    )
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    mirror_parser = subparsers.add_parser(
+        "mirror",
+        help="Serve the CurseMaven endpoints from a local cache",
+        parents=[common_parser],
+    )
+    mirror_parser.add_argument(
+        "--host", default="0.0.0.0", help="Address to listen on (default: 0.0.0.0)"
+    )
+    mirror_parser.add_argument(
+        "--port", type=int, default=8080, help="Port to listen on (default: 8080)"
+    )
+    mirror_parser.add_argument(
+        "--upstream",
+        default=cursemaven.DEFAULT_CURSEMAVEN_URL,
+        help=f"CurseMaven to download the missing files from, --maven-url and $CURSEMAVEN_URL are ignored (default: {cursemaven.DEFAULT_CURSEMAVEN_URL})",
+    )
+
+    daemon_parser = subparsers.add_parser(
+        "daemon",
+        help="Run install, update, prefetch and retry jobs sent to a local HTTP API, keeping connections and caches warm",
+        parents=[common_parser],
+    )
+    daemon_parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Address to listen on, keep it local since jobs can write anywhere (default: 127.0.0.1)",
+    )
+    daemon_parser.add_argument(
+        "--port", type=int, default=8765, help="Port to listen on (default: 8765)"
+    )
+    daemon_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=4,
+        help="Number of jobs running at the same time (default: 4)",
+    )
+
+    prefetch_parser = subparsers.add_parser(
+        "prefetch",
+        help="Download a modpack's files into the cache without installing them",
+        parents=[common_parser],
+    )
+    prefetch_parser.add_argument(
+        "manifest", help="Path to the modpack's ZIP file or to a manifest.json"
+    )
+
+    export_parser = subparsers.add_parser(
+        "export",
+        help="Write a modpack, installed, straight into an archive without an instance folder",
+        parents=[common_parser],
+    )
+    export_parser.add_argument(
+        "modpack", help="Path to the modpack's ZIP file or .mrpack file"
+    )
+    export_parser.add_argument(
+        "archive",
+        help="Archive to write (.zip, .tar, .tar.gz, .tar.xz or .tar.zst), with the same layout as the instance folder",
+    )
+    export_parser.add_argument(
+        "--side",
+        choices=["client", "server"],
+        default=argparse.SUPPRESS,
+        help="Side to export Modrinth modpacks for (default: client)",
+    )
+
+    catalog_parser = subparsers.add_parser(
+        "catalog",
+        help="Index a folder of modpacks to search which packs include a mod",
+        parents=[common_parser],
+    )
+    catalog_parser.add_argument(
+        "--catalog",
+        help="Path to the catalog database (default: catalog.sqlite in the cache folder)",
+    )
+    catalog_subparsers = catalog_parser.add_subparsers(
+        dest="catalog_command", required=True
+    )
+    catalog_scan_parser = catalog_subparsers.add_parser(
+        "scan", help="Add or update the modpacks of a folder, only the changed ones are read again"
+    )
+    catalog_scan_parser.add_argument("folder", help="Folder with the modpacks")
+    catalog_scan_parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of scanning processes (default: the number of CPUs)",
+    )
+    catalog_find_parser = catalog_subparsers.add_parser(
+        "find", help="List the packs that include a project, or a specific file of it"
+    )
+    catalog_find_parser.add_argument("project", help="The project ID")
+    catalog_find_parser.add_argument("file", nargs="?", help="The file ID")
+    catalog_union_parser = catalog_subparsers.add_parser(
+        "union", help="List every file included in at least one of the given packs"
+    )
+    catalog_union_parser.add_argument("packs", nargs="+", help="Paths of the packs")
+    catalog_subparsers.add_parser("list", help="List the packs in the catalog")
+
+    retry_parser = subparsers.add_parser(
+        "retry",
+        help="Download again only the mods that failed in the last install into a folder",
+        parents=[common_parser],
+    )
+    retry_parser.add_argument("path", help="Path of the instance folder")
+
+    swap_parser = subparsers.add_parser(
+        "swap",
+        help="Replace an instance with its staged version, keeping the current one for rollbacks",
+        parents=[common_parser],
+    )
+    swap_parser.add_argument("path", help="Path of the instance folder")
+
+    rollback_parser = subparsers.add_parser(
+        "rollback",
+        help="Swap an instance with its previous version",
+        parents=[common_parser],
+    )
+    rollback_parser.add_argument("path", help="Path of the instance folder")
 
     args = parser.parse_args()
     modpack_path = args.file
     extraction_path = args.path
 
+    if getattr(args, "maven_url", None):
+        cursemaven.CURSEMAVEN_URL = args.maven_url.rstrip("/")
+
+    if getattr(args, "min_speed", None) is not None:
+        cursemaven.MIN_DOWNLOAD_SPEED = args.min_speed * 1024
+
+    if getattr(args, "fallback", None):
+        fallback.FALLBACK_SOURCES.extend(args.fallback)
+
+    if getattr(args, "no_fallback", False):
+        fallback.FALLBACK_SOURCES.clear()
+
+    deadline: float | None = getattr(args, "deadline", None)
+    hedge = not getattr(args, "no_hedge", False)
+
+    cache_dir: str | None = getattr(args, "cache", None)
+    cache = None if getattr(args, "no_cache", False) else ArtifactCache(cache_dir)
+
+    ############### Other commands ###############
+
+    if args.command == "mirror":
+        from mirror import serve_mirror  # The HTTP server is only needed here
+
+        serve_mirror(args.host, args.port, cache_dir, args.upstream)
+        sys.exit(0)
+
+    if args.command == "daemon":
+        from daemon import serve_daemon  # The HTTP server is only needed here
+
+        serve_daemon(args.host, args.port, cache, args.jobs)
+        sys.exit(0)
+
+    if args.command == "prefetch":
+        try:
+            prefetched = prefetch_modpack(
+                args.manifest,
+                cache or ArtifactCache(cache_dir),
+                getattr(args, "results", None),
+            )
+        except KeyboardInterrupt:
+            print()
+            print("Interrupted", color="r")
+            sys.exit(130)
+        sys.exit(0 if prefetched is not None else 1)
+
+    export_path: str | None = getattr(args, "archive", None) or args.export
+    if export_path is not None:
+        from export import archive_error
+
+        error = archive_error(export_path)
+        if error is not None:
+            print(error, tag="Error", tag_color="r", color="r")
+            sys.exit(1)
+
+    if args.command == "export":
+        try:
+            exported = export_modpack(
+                args.modpack,
+                args.archive,
+                cache or ArtifactCache(cache_dir),
+                args.side,
+                getattr(args, "results", None),
+            )
+        except KeyboardInterrupt:
+            print()
+            print("Interrupted", color="r")
+            sys.exit(130)
+        sys.exit(0 if exported is not None else 1)
+
+    if args.command == "catalog":
+        import time
+        import catalog  # Loads sqlite only when needed
+
+        connection = catalog.open_catalog(args.catalog, cache_dir)
+        started = time.perf_counter()
+
+        if args.catalog_command == "scan":
+            scanned, removed, total = catalog.update_catalog(
+                connection, args.folder, args.workers
+            )
+            print(
+                f"{total} packs, {scanned} scanned, {removed} removed",
+                tag="Catalog updated",
+                color="w",
+                tag_color="g",
+            )
+
+        elif args.catalog_command == "find":
+            packs = catalog.packs_with(connection, args.project, args.file)
+            for pack in packs:
+                print(
+                    f" {pack['name']} {pack['version']} ({pack['path']})",
+                    tag=f"File {pack['file_id']}",
+                    tag_color="c",
+                    color="w",
+                )
+            print(f"{len(packs)} packs found", color="g" if packs else "y")
+
+        elif args.catalog_command == "union":
+            files = catalog.packs_union(connection, args.packs)
+            for file in files:
+                print(
+                    f" {file['name'] or ''} (in {file['packs']}/{len(args.packs)} packs)",
+                    tag=f"{file['project_id']}:{file['file_id']}",
+                    tag_color="c",
+                    color="w",
+                )
+            print(f"{len(files)} files", color="g")
+
+        elif args.catalog_command == "list":
+            packs = catalog.list_packs(connection)
+            for pack in packs:
+                print(
+                    f" {pack['name']} {pack['version']} - Minecraft {pack['minecraft']}, "
+                    f"{pack['files']} files ({pack['path']})",
+                    tag=pack["format"],
+                    tag_color="c",
+                    color="w",
+                )
+            print(f"{len(packs)} packs", color="g")
+
+        connection.close()
+        print(f"{(time.perf_counter() - started) * 1000:.1f} ms", tag="Time", color="w")
+        sys.exit(0)
+
+    if args.command == "retry":
+        # Checked before taking the lock, that would create a lock file next to a missing folder
+        if not os.path.isdir(args.path):
+            print("Folder not found", tag="Error", tag_color="r", color="r")
+            sys.exit(1)
+
+        instance_lock = wait_instance_lock(args.path)
+        assert instance_lock is not None  # Without should_stop it waits until taken
+        try:
+            retried = retry_failed(
+                args.path,
+                cache,
+                deadline,
+                hedge,
+                getattr(args, "results", None),
+            )
+        except KeyboardInterrupt:
+            print()
+            print("Interrupted, the files downloaded until now are kept", color="r")
+            sys.exit(130)
+        if retried is None:
+            sys.exit(1)
+        instance_lock.release()
+
+        still_failed = os.path.exists(failures_path(args.path))
+        if still_failed:
+            wait_for_input()  # Keeps the eventual missing mods page until closed
+            retried.cleanup()
+        sys.exit(1 if still_failed else 0)
+
+    if args.command == "swap":
+        wait_instance_lock(args.path)
+        if not swap_staging(args.path):
+            print(
+                "Nothing staged for this folder", tag="Error", tag_color="r", color="r"
+            )
+            sys.exit(1)
+        print(args.path, tag="Staged version swapped in", color="w", tag_color="g")
+        sys.exit(0)
+
+    if args.command == "rollback":
+        wait_instance_lock(args.path)
+        if not rollback(args.path):
+            print(
+                "No previous version to roll back to",
+                tag="Error",
+                tag_color="r",
+                color="r",
+            )
+            sys.exit(1)
+        print(args.path, tag="Rolled back", color="w", tag_color="g")
+        sys.exit(0)
+
     ############### ZIP file selection ###############
 
     if not modpack_path:
-        print("Please select the modpack ZIP file", color="m", format="bold")
-        modpack_path = file_input_dialog(extension="zip")
+        print("Please select the modpack ZIP or .mrpack file", color="m", format="bold")
+        modpack_path = file_input_dialog(extension="*.zip *.mrpack")
 
     if not modpack_path:
         print("Cancelled", color="r")
@@ -101,7 +498,50 @@ if __name__ == "__main__":
 
     ############### Download the modpack ###############
 
-    modpack = extract_modpack(modpack_path, extraction_path)
+    # Other installers into the same folder wait for this one
+    instance_lock = wait_instance_lock(extraction_path)
+    assert instance_lock is not None
+
+    install_path = extraction_path
+    if args.staged:
+        install_path = prepare_staging(extraction_path)
+        print(install_path, tag="Staging folder", color="w", tag_color="y")
+        print()
+
+    try:
+        modpack = extract_modpack(
+            modpack_path,
+            install_path,
+            cache,
+            args.lock,
+            args.write_lock,
+            deadline,
+            hedge,
+            args.side,
+            extraction_path if args.staged else None,
+            getattr(args, "results", None),
+            None,
+            args.export,
+        )
+    except KeyboardInterrupt:
+        print()
+        print("Interrupted, the files downloaded until now are kept", color="r")
+        sys.exit(130)
+
+    if modpack is not None and args.staged:
+        # Copied now, so the swap only needs to copy what changes until then
+        if os.path.isdir(extraction_path):
+            carried = carry_over(extraction_path, install_path)
+            print(f"{carried} files", tag="Carried over", color="w", tag_color="c")
+        print()
+        print(
+            "Stop the game or server using it, then run:",
+            tag="Staged",
+            color="w",
+            tag_color="g",
+        )
+        print(f'python main.py swap "{extraction_path}"', color="y")
+    instance_lock.release()
 
     wait_for_input()
     if modpack is not None:
@@ -0,0 +1,144 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit
+from print_color import print
+import os
+import re
+import shutil
+
+from cache import ArtifactCache
+from cursemaven import DEFAULT_CURSEMAVEN_URL, GROUP_PATH
+import cursemaven
+from singleflight import SingleFlight
+
+TEST_PATH_RE = re.compile(r"^/test/(?P<project>\d+)/(?P<file>\d+)/?$")
+# Only the IDs matter, the artifact name and the jar name can be anything (same as on CurseMaven)
+MAVEN_PATH_RE = re.compile(
+    rf"^/{GROUP_PATH}/(?P<artifact>[^/]+)-(?P<project>\d+)/(?P<file>\d+)/[^/]+$"
+)
+
+
+class MirrorServer(ThreadingHTTPServer):
+    """HTTP server exposing the same endpoints used by cursemaven.py, backed by the local artifact cache.
+    Missing files are requested from the upstream CurseMaven only once, even if many clients ask for them at the same time.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, cache: ArtifactCache):
+        super().__init__(address, MirrorRequestHandler)
+        self.cache = cache
+        self.flights = SingleFlight()
+
+    def resolve(self, project_id: int, file_id: int) -> str | None:
+        return self.flights.do(
+            ("resolve", project_id, file_id), self.cache.resolve, project_id, file_id
+        )
+
+    def fetch(self, project_id: int, file_id: int) -> str | None:
+        return self.flights.do(
+            ("fetch", project_id, file_id), self.cache.fetch, project_id, file_id
+        )
+
+
+class MirrorRequestHandler(BaseHTTPRequestHandler):
+    server: MirrorServer
+
+    def log_message(self, format, *args):
+        pass  # Keep the console clean
+
+    def _send_text(self, code: int, text: str) -> None:
+        body = text.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _handle_test(self, project_id: int, file_id: int) -> None:
+        filename = self.server.resolve(project_id, file_id)
+        if filename is None:
+            self._send_text(404, "Not found\n")
+            return
+
+        # Point the client back to this mirror, so that the filename HEAD request stays local too
+        host = self.headers.get("Host") or "%s:%d" % self.server.server_address[:2]
+        url = f"http://{host}/{GROUP_PATH}/mirror-{project_id}/{file_id}/{quote(filename)}"
+        self._send_text(200, f"Found: {url}\n")
+
+    def _handle_maven(self, project_id: int, file_id: int) -> None:
+        filename = self.server.resolve(project_id, file_id)
+        if filename is None:
+            self._send_text(404, "Not found\n")
+            return
+
+        disposition = f'attachment; filename="{filename}"'
+
+        if self.command == "HEAD":
+            self.send_response(200)
+            self.send_header("Content-Disposition", disposition)
+            self.end_headers()
+            return
+
+        path = self.server.fetch(project_id, file_id)
+        if path is None:
+            self._send_text(502, "Upstream download failed\n")
+            return
+
+        with open(path, "rb") as f:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/java-archive")
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.send_header("Content-Disposition", disposition)
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+    def do_GET(self):
+        path = unquote(urlsplit(self.path).path)
+
+        try:
+            if match := TEST_PATH_RE.match(path):
+                self._handle_test(int(match["project"]), int(match["file"]))
+            elif match := MAVEN_PATH_RE.match(path):
+                self._handle_maven(int(match["project"]), int(match["file"]))
+            else:
+                self._send_text(404, "Not found\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client went away
+        except:
+            self._send_text(502, "Upstream error\n")
+
+    def do_HEAD(self):
+        self.do_GET()
+
+
+def serve_mirror(
+    host: str,
+    port: int,
+    cache_dir: str | None = None,
+    upstream: str = DEFAULT_CURSEMAVEN_URL,
+) -> None:
+    """Runs the mirror server until interrupted.
+
+    Args:
+        host (str): The address to listen on
+        port (int): The port to listen on
+        cache_dir (str | None, optional): The cache folder. Defaults to the default cache folder.
+        upstream (str, optional): The CurseMaven to download the missing files from. Defaults to DEFAULT_CURSEMAVEN_URL.
+    """
+    # Not CURSEMAVEN_URL, that on the machine running the mirror could point to the mirror itself
+    cursemaven.CURSEMAVEN_URL = upstream.rstrip("/")
+    cache = ArtifactCache(cache_dir)
+
+    with MirrorServer((host, port), cache) as server:
+        print(
+            f"http://{host}:{port} (cache: {cache.cache_dir}, upstream: {upstream})",
+            tag="Mirror listening on",
+            tag_color="c",
+            color="w",
+        )
+        print("Press Ctrl+C to stop", color="m")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -1,5 +1,5 @@
 from enum import Enum, EnumMeta
-from typing import Dict, Tuple, cast
+from typing import Dict, List, Tuple, cast
 from print_color.print_color import Color as color_typing
 
 
@@ -31,9 +31,10 @@ class ModType(Enum, metaclass=ModTypeMeta):
 class ModElement:
     """Class to represent each mod file in the modpack"""
 
-    def __init__(self, project_id: int, file_id: int):
-        self.project_id: int = project_id
-        self.file_id: int = file_id
+    def __init__(self, project_id: int | str, file_id: int | str):
+        # For Modrinth files these are MODRINTH_PROJECT and the sha1 of the file (see mrpack.py)
+        self.project_id: int | str = project_id
+        self.file_id: int | str = file_id
         self.filename: str = ""
 
         self.file_type: ModType = ModType.DEFAULT
@@ -43,6 +44,46 @@ class ModElement:
         self.curseforge_url: str | None = None
         self.download_url: str | None = None
 
+        # Resolved from CurseMaven, or loaded from a lockfile
+        self.cdn_url: str | None = None
+        self.size: int | None = None
+        self.hashes: Dict[str, str] = {}  # hashlib algorithm name -> hex digest
+        self.target_folder: str | None = None  # Relative to the output path
+        self.direct_urls: List[str] = []  # Known urls of the file, used instead of CurseMaven
+
+    def to_dict(self) -> Dict:
+        """Converts the element to a JSON serializable dict, used by the lockfiles and the failed mods lists."""
+        return {
+            "projectID": self.project_id,
+            "fileID": self.file_id,
+            "filename": self.filename,
+            "url": self.cdn_url,
+            "urls": self.direct_urls,
+            "size": self.size,
+            "hashes": self.hashes,
+            "folder": self.target_folder,
+            "type": self.file_type.name,
+            "name": self.view_name,
+            "curseforgeUrl": self.curseforge_url,
+        }
+
+    @staticmethod
+    def from_dict(data: Dict) -> "ModElement":
+        """Creates an element from a dict made by to_dict."""
+        mod_element = ModElement(data["projectID"], data["fileID"])
+        mod_element.filename = data.get("filename") or ""
+        mod_element.cdn_url = data.get("url")
+        mod_element.direct_urls = data.get("urls") or []
+        mod_element.size = data.get("size")
+        mod_element.hashes = data.get("hashes") or {}
+        mod_element.target_folder = data.get("folder")
+        mod_element.file_type = ModType.__members__.get(
+            data.get("type", ""), ModType.DEFAULT
+        )
+        mod_element.view_name = data.get("name")
+        mod_element.curseforge_url = data.get("curseforgeUrl")
+        return mod_element
+
 
 mod_type_names_map: Dict[ModType, str] = {
     ModType.MOD: "     MOD     ",
@@ -1,6 +1,4 @@
 from typing import List, Iterator, TypedDict
-import bs4
-from bs4 import BeautifulSoup
 
 from utils import load_file_from_zip
 from mod import ModType
@@ -25,6 +23,10 @@ class Modlist:
         self.modpack_path: str = modpack_path
         self.modlist_file: str = modlist_file
 
+        # Imported here because the HTML parser is slow to import and not every pack has a modlist
+        import bs4
+        from bs4 import BeautifulSoup
+
         try:
             html_bytes = load_file_from_zip(self.modpack_path, self.modlist_file)
             loaded_html = BeautifulSoup(html_bytes, "html.parser")
@@ -1,33 +1,91 @@
-from typing import Dict, Iterator, List
+from typing import Dict, Iterator, List, Set, Tuple
 import zipfile
 import os
 import json
-
-from utils import load_file_from_zip
-from cursemaven import mod_name_from_id, download_mod
+import time
+import statistics
+import threading
+
+from utils import load_file_from_zip, link_or_copy, temp_path, file_hashes
+from cursemaven import (
+    Transfer,
+    resolve_cdn_url,
+    filename_from_cdn_url,
+    download_mod,
+    download_file,
+)
+from cache import ArtifactCache
 from modlist import Modlist
+from mrpack import (
+    MODRINTH_INDEX_FILE,
+    OVERRIDES_FOLDER,
+    SIDE_OVERRIDES_FOLDERS,
+    load_mrpack_index,
+    get_mrpack_minecraft_version,
+    mrpack_mod_elements,
+)
 from mod import ModElement, ModType
+from singleflight import SingleFlight
 
 MANIFEST_FILE = "manifest.json"
 MODLIST_FILE = "modlist.html"
 
+HEDGE_MIN_AGE = 5  # Seconds a download has to be running before it can be hedged
+HEDGE_SLOWDOWN = 4  # How many times slower than the median a download has to be to be hedged
+HEDGE_MIN_SAMPLES = 3  # Completed downloads needed to compute the median speed
+
 
 def is_modpack_valid(modpack_path: str) -> bool:
     """Checks if a modpack is valid
 
     Args:
-        modpack_path (str): The modpack's ZIP file path
+        modpack_path (str): The modpack's ZIP or .mrpack file path
 
     Returns:
         bool: True if the pack is valid, false otherwise
     """
     try:
         with zipfile.ZipFile(modpack_path, "r") as z:
-            return MANIFEST_FILE in z.namelist()
+            names = z.namelist()
+            return MANIFEST_FILE in names or MODRINTH_INDEX_FILE in names
+    except:
+        return False
+
+
+def is_mrpack(modpack_path: str) -> bool:
+    """Checks if a modpack is a Modrinth modpack
+
+    Args:
+        modpack_path (str): The modpack's file path
+
+    Returns:
+        bool: True if the pack contains a Modrinth index, false otherwise
+    """
+    try:
+        with zipfile.ZipFile(modpack_path, "r") as z:
+            return MODRINTH_INDEX_FILE in z.namelist()
     except:
         return False
 
 
+def load_manifest(modpack_path: str) -> Dict:
+    """Loads the manifest of a modpack, either from the modpack's ZIP file or from a bare manifest.json file.
+
+    Args:
+        modpack_path (str): The path to the pack's ZIP file or to its manifest.json
+
+    Returns:
+        Dict: The manifest json file loaded as a Python dict
+    """
+    if modpack_path.lower().endswith(".json"):
+        with open(modpack_path, "rb") as f:
+            json_bytes = f.read()
+    else:
+        json_bytes = load_file_from_zip(modpack_path, MANIFEST_FILE)
+
+    return json.loads(json_bytes.decode("utf-8"))
+
+
 def get_minecraft_version(modpack_content: Dict) -> str:
     """Gets the minecraft version for the given manifest dict
 
@@ -60,37 +118,47 @@ def get_minecraft_version_wrapper(modpack_path: str) -> str | None:
     Used to get the version before loading the pack.
 
     Args:
-        modpack_path (str): The path to the pack's ZIP file
+        modpack_path (str): The path to the pack's ZIP or .mrpack file
 
     Returns:
         str | None: The minecraft version as "version - loader id" or None if the modpack couldnt be loaded.
     """
     try:
-        json_bytes = load_file_from_zip(modpack_path, MANIFEST_FILE)
-        json_str = json_bytes.decode("utf-8")
-        manifest = json.loads(json_str)
+        if is_mrpack(modpack_path):
+            version = get_mrpack_minecraft_version(load_mrpack_index(modpack_path))
+        else:
+            version = get_minecraft_version(load_manifest(modpack_path))
     except:
         return None
 
-    version = get_minecraft_version(manifest)
     return version if version else None  # Turn the "" into None
 
 
 class Modpack:
     """Class to store modpack-relative information, used to simplify passing those variables into functions."""
 
-    def __init__(self, modpack_path: str, extraction_path: str):
+    def __init__(
+        self,
+        modpack_path: str,
+        extraction_path: str,
+        cache: ArtifactCache | None = None,
+        side: str = "client",
+    ):
         """Set the paths for the modpack.
 
         Args:
-            modpack_path (str): Path to the modpack's ZIP file
+            modpack_path (str): Path to the modpack's ZIP or .mrpack file (or to a bare manifest.json)
             extraction_path (str): Output path
+            cache (ArtifactCache | None, optional): Cache used for the filenames and the downloads. Defaults to None.
+            side (str, optional): "client" or "server", used by Modrinth modpacks to choose the files. Defaults to "client".
         """
         self.modpack_path = modpack_path
         self.output_path = extraction_path
+        self.cache = cache
+        self.side = side
 
         # Those will be set later
-        self.overrides: str | None = None
+        self.overrides: List[str] = []  # Folders in the modpack's ZIP to extract
         self.minecraft_version: str = ""
         self.modpack_name: str = ""
         self.modpack_version: str = ""
@@ -111,22 +179,92 @@ class Modpack:
             ModType.SHADERPACK: self.shaderpack_folder,
         }
 
-    def load_modpack(self) -> bool:
+        # Some packs list the same file more than once, so identical requests are done only once
+        self.flights = SingleFlight()
+        self.resolved: Dict[Tuple[int, int], Tuple[str, str | None]] = {}
+        self.downloaded: Set[Tuple] = set()
+
+        # Set when the files come from a lockfile, to download them from their recorded url
+        self.use_direct_urls: bool = False
+
+        # time.monotonic() value after which no more downloads are started or continued
+        self.deadline: float | None = None
+
+        # Existing instance to take the unchanged files from, when installing into a staging folder
+        self.reuse_path: str | None = None
+
+        # Running downloads, used to hedge the slow ones with a second request
+        self.transfers_lock = threading.Lock()
+        self.transfers: Dict[Tuple, List[Transfer]] = {}
+        self.transfer_elements: Dict[Tuple, ModElement] = {}
+        self.hedged: Set[Tuple] = set()
+        self.completed_speeds: List[float] = []
+
+        # Set by stop, makes the running downloads abort and no new ones start
+        self.stopped = threading.Event()
+
+        # Why each failed mod (by index) couldnt be downloaded, saved in the failed mods list
+        self.failures: Dict[int, str] = {}
+
+    def load_modpack(self, create_folders: bool = True) -> bool:
         """Try loading the modpack.
 
+        Args:
+            create_folders (bool, optional): Whether to create the output folders. Defaults to True.
+
+        Returns:
+            bool: True if the pack has been loaded successfully, False otherwise.
+        """
+        if is_mrpack(self.modpack_path):
+            loaded = self._load_mrpack()
+        else:
+            loaded = self._load_manifest()
+
+        if loaded and create_folders:
+            os.makedirs(self.mods_folder, exist_ok=True)
+            os.makedirs(self.resourcepack_folder, exist_ok=True)
+            os.makedirs(self.shaderpack_folder, exist_ok=True)
+
+        return loaded
+
+    def _load_mrpack(self) -> bool:
+        """Loads a Modrinth modpack, whose files are already resolved.
+
+        Returns:
+            bool: True if the pack has been loaded successfully, False otherwise.
+        """
+        try:
+            index = load_mrpack_index(self.modpack_path)
+        except:
+            return False
+
+        self.overrides = [OVERRIDES_FOLDER]
+        if self.side in SIDE_OVERRIDES_FOLDERS:
+            self.overrides.append(SIDE_OVERRIDES_FOLDERS[self.side])
+
+        self.minecraft_version = get_mrpack_minecraft_version(index)
+        self.modpack_name = index.get("name", "")
+        self.modpack_version = index.get("versionId", "")
+        self.mods = mrpack_mod_elements(index, self.side)
+
+        self.use_direct_urls = True
+        return True
+
+    def _load_manifest(self) -> bool:
+        """Loads a CurseForge modpack from its manifest.
+
         Returns:
             bool: True if the pack has been loaded successfully, False otherwise.
         """
         try:
-            json_bytes = load_file_from_zip(self.modpack_path, MANIFEST_FILE)
-            json_str = json_bytes.decode("utf-8")
-            manifest = json.loads(json_str)
+            manifest = load_manifest(self.modpack_path)
         except:
             return False
 
         modlist = Modlist(self.modpack_path, MODLIST_FILE)
 
-        self.overrides: str | None = manifest.get("overrides", None)
+        overrides: str | None = manifest.get("overrides", None)
+        self.overrides = [overrides] if overrides is not None else []
         self.minecraft_version: str = get_minecraft_version(manifest)
         self.modpack_name: str = manifest.get("name", "")
         self.modpack_version: str = manifest.get("version", "")
@@ -151,12 +289,37 @@ class Modpack:
 
                 self.mods.append(mod_element)
 
-        os.makedirs(self.mods_folder, exist_ok=True)
-        os.makedirs(self.resourcepack_folder, exist_ok=True)
-        os.makedirs(self.shaderpack_folder, exist_ok=True)
-
         return True
 
+    def set_deadline(self, seconds: float | None) -> None:
+        """Sets the time budget for the downloads, starting from now.
+
+        Args:
+            seconds (float | None): The budget in seconds, or None for no limit
+        """
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+
+    def time_left(self) -> float | None:
+        """Gets the remaining time before the deadline.
+
+        Returns:
+            float | None: The remaining seconds (0 if expired or stopped), or None if there is no deadline
+        """
+        if self.stopped.is_set():
+            return 0
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def stop(self) -> None:
+        """Cancels all the running downloads, and makes the next ones fail immediately.
+        The files already downloaded are kept."""
+        self.stopped.set()
+        with self.transfers_lock:
+            for transfers in self.transfers.values():
+                for transfer in transfers:
+                    transfer.cancel()
+
     def __getitem__(self, idx: int):
         return self.mods[idx]
 
@@ -176,16 +339,44 @@ class Modpack:
             bool: True if the mod exists in the repo, False otherwise
         """
         mod_element: ModElement = self[mod_index]
+        if mod_element.filename:  # Already resolved, from a lockfile or a Modrinth index
+            return True
 
-        filename: str | None = mod_name_from_id(
-            mod_element.project_id, mod_element.file_id
+        key = (mod_element.project_id, mod_element.file_id)
+        resolved = self.resolved.get(key) or self.flights.do(
+            ("filename", *key), self._resolve, *key
         )
-        if not filename:
+        if not resolved:
             return False
 
-        mod_element.filename = filename
+        self.resolved[key] = resolved
+        mod_element.filename, mod_element.cdn_url = resolved
         return True
 
+    def _resolve(self, project_id: int, file_id: int) -> Tuple[str, str | None] | None:
+        """Resolves a file through the cache if present, otherwise directly from the repo.
+
+        Args:
+            project_id (int)
+            file_id (int)
+
+        Returns:
+            Tuple[str, str | None] | None: (filename, cdn url), or None if the file doesnt exist in the repo
+        """
+        if self.cache is not None:
+            filename = self.cache.resolve(project_id, file_id)
+            if filename is None:
+                return None
+
+            meta = self.cache.get_meta(project_id, file_id) or {}
+            return filename, meta.get("cdn_url")
+
+        cdn_url = resolve_cdn_url(project_id, file_id)
+        if not cdn_url:
+            return None
+
+        return filename_from_cdn_url(cdn_url), cdn_url
+
     def download_resource(self, mod_index: int) -> bool:
         """Downloads the resource (mod or whatever) indicated by the index to its folder.
 
@@ -197,23 +388,307 @@ class Modpack:
         """
 
         mod_element: ModElement = self[mod_index]
+        key = self.download_key(mod_element)
 
-        target_folder = self.folder_map.get(mod_element.file_type)
-        if target_folder is None:  # If its the default file type try to guess it
-            is_texturepack = mod_element.filename.endswith(".zip")
-            target_folder = (
-                self.resourcepack_folder if is_texturepack else self.mods_folder
-            )
+        if key in self.downloaded:  # Duplicate of an already downloaded file
+            return True
+
+        return self.flights.do(("download", *key), self._download_element, mod_element)
+
+    def prefetch_resource(self, mod_index: int) -> bool:
+        """Downloads the resource indicated by the index only into the cache.
+
+        Args:
+            mod_index (int): The mod index
+
+        Returns:
+            bool: True if the mod is in the cache and matches its size and hashes, False otherwise.
+        """
+        assert self.cache is not None
+
+        mod_element: ModElement = self[mod_index]
+        cached_path = self.flights.do(
+            ("prefetch", mod_element.project_id, mod_element.file_id),
+            self.cache.fetch,
+            mod_element.project_id,
+            mod_element.file_id,
+            mod_element.filename or None,
+            self._transfer_url(mod_element, False),
+            self.deadline,
+        )
+        if cached_path is None:
+            return False
+
+        # A corrupted cached file would end up in the exported archives
+        if not self.verify_file(mod_element, cached_path):
+            self.cache.evict(mod_element.project_id, mod_element.file_id)
+            return False
+
+        return True
 
-        download_filepath = os.path.join(target_folder, mod_element.filename)
+    def download_key(self, mod_element: ModElement) -> Tuple:
+        """Gets the key identifying the download of a mod, the same file can be needed in more than one path.
+
+        Args:
+            mod_element (ModElement): The mod, with its filename already requested
 
-        return download_mod(
-            mod_element.filename,
-            download_filepath,
+        Returns:
+            Tuple: (project id, file id, target path)
+        """
+        return (
             mod_element.project_id,
             mod_element.file_id,
+            self.target_path(mod_element),
         )
 
+    def target_path(self, mod_element: ModElement) -> str:
+        """Gets the path where a resource will be saved, based on its type.
+
+        Args:
+            mod_element (ModElement): The mod, with its filename already requested
+
+        Raises:
+            ValueError: If the path would be outside of the output folder,
+                like with a filename from a tampered lockfile or failed mods list
+
+        Returns:
+            str: The path of the file in the output folder
+        """
+        if mod_element.target_folder is not None:
+            path = os.path.join(
+                self.output_path, mod_element.target_folder, mod_element.filename
+            )
+        else:
+            target_folder = self.folder_map.get(mod_element.file_type)
+            if target_folder is None:  # If its the default file type try to guess it
+                is_texturepack = mod_element.filename.endswith(".zip")
+                target_folder = (
+                    self.resourcepack_folder if is_texturepack else self.mods_folder
+                )
+            path = os.path.join(target_folder, mod_element.filename)
+
+        output_path = os.path.realpath(self.output_path)
+        try:
+            inside = (
+                os.path.commonpath([os.path.realpath(path), output_path])
+                == output_path
+            )
+        except ValueError:  # Different drives on windows
+            inside = False
+        if not inside or os.path.realpath(path) == output_path:
+            raise ValueError(f"{mod_element.filename} is outside of the output folder")
+
+        return path
+
+    def stragglers(self, queue_drained: bool) -> List[ModElement]:
+        """Finds the running downloads that should be hedged with a second request:
+        the ones far slower than the median, or, once there is nothing left to start, the ones slower than the median.
+
+        Args:
+            queue_drained (bool): True if every remaining download is already running
+
+        Returns:
+            List[ModElement]: The mods to hedge, each one is returned only once
+        """
+        with self.transfers_lock:
+            median_speed = (
+                statistics.median(self.completed_speeds)
+                if len(self.completed_speeds) >= HEDGE_MIN_SAMPLES
+                else None
+            )
+
+            result: List[ModElement] = []
+            for key, transfers in self.transfers.items():
+                if key in self.hedged or len(transfers) != 1:
+                    continue
+
+                transfer = transfers[0]
+                if transfer.elapsed() < HEDGE_MIN_AGE:
+                    continue
+
+                if median_speed is None:
+                    is_straggler = queue_drained
+                elif queue_drained:
+                    is_straggler = transfer.speed() < median_speed
+                else:
+                    is_straggler = transfer.speed() < median_speed / HEDGE_SLOWDOWN
+
+                if is_straggler:
+                    self.hedged.add(key)
+                    result.append(self.transfer_elements[key])
+
+            return result
+
+    def hedge_resource(self, mod_element: ModElement) -> bool:
+        """Starts a second download of a mod that is already being downloaded, through the other url if there is one.
+        The first one that finishes is kept and the other one is cancelled.
+
+        Args:
+            mod_element (ModElement): The mod being downloaded
+
+        Returns:
+            bool: True if the mod was successfully downloaded by either request, False otherwise.
+        """
+        key = self.download_key(mod_element)
+        with self.transfers_lock:
+            running = key in self.transfers
+
+        # The hedge could have waited in the queue until the first request finished
+        if not running or self.stopped.is_set():
+            return key in self.downloaded
+
+        return self._download_element(mod_element, hedge=True)
+
+    def cancel_transfers(self, mod_element: ModElement) -> None:
+        """Cancels the running downloads of a mod, like the hedge requests still running when the install ends."""
+        with self.transfers_lock:
+            for transfer in self.transfers.get(self.download_key(mod_element), []):
+                transfer.cancel()
+
+    def _download_element(self, mod_element: ModElement, hedge: bool = False) -> bool:
+        """Downloads the file keeping track of its progress, so it can be hedged (see stragglers).
+        Once a download of a file succeeds, the other ones still running for the same file are cancelled.
+
+        Args:
+            mod_element (ModElement): The mod to download
+            hedge (bool, optional): True if this is the second request for the mod. Defaults to False.
+
+        Returns:
+            bool: True if the mod was successfully downloaded, by this or by another request, False otherwise.
+        """
+        key = self.download_key(mod_element)
+        transfer = Transfer()
+
+        with self.transfers_lock:
+            self.transfers.setdefault(key, []).append(transfer)
+            self.transfer_elements[key] = mod_element
+            if self.stopped.is_set():
+                transfer.cancel()
+
+        success = False
+        try:
+            success = self._transfer_element(mod_element, transfer, hedge)
+        finally:
+            with self.transfers_lock:
+                self.transfers[key].remove(transfer)
+                if not self.transfers[key]:
+                    del self.transfers[key]
+                    del self.transfer_elements[key]
+
+                if success and transfer.bytes_done > 0:  # Not from the cache
+                    self.completed_speeds.append(transfer.speed())
+                if success:
+                    # Before cancelling, so the cancelled ones see that the file is there
+                    self.downloaded.add(key)
+                    for other in self.transfers.get(key, []):
+                        other.cancel()  # This request won
+
+        return success or key in self.downloaded
+
+    def _transfer_url(self, mod_element: ModElement, hedge: bool) -> str | None:
+        """Chooses the url to download a file from, so that a hedge request uses a different one when possible.
+
+        Args:
+            mod_element (ModElement): The mod to download
+            hedge (bool): True if this is the second request for the mod
+
+        Returns:
+            str | None: The url, or None to download it from CurseMaven
+        """
+        if mod_element.direct_urls:  # Modrinth files can have more than one url
+            return mod_element.direct_urls[int(hedge) % len(mod_element.direct_urls)]
+
+        return mod_element.cdn_url if self.use_direct_urls != hedge else None
+
+    def _transfer_element(
+        self, mod_element: ModElement, transfer: Transfer, hedge: bool
+    ) -> bool:
+        """Downloads the file to a temporary name in its folder and then renames it,
+        so the final file is never left half written.
+
+        Args:
+            mod_element (ModElement): The mod to download
+            transfer (Transfer): The progress of this download
+            hedge (bool): True to use the url that the first request isnt using
+
+        Returns:
+            bool: True if the mod was successfully downloaded, False otherwise.
+        """
+        download_filepath = self.target_path(mod_element)
+        direct_url = self._transfer_url(mod_element, hedge)
+        os.makedirs(os.path.dirname(download_filepath), exist_ok=True)
+
+        if self.reuse_path is not None:
+            relative_path = os.path.relpath(download_filepath, self.output_path)
+            existing_path = os.path.join(self.reuse_path, relative_path)
+            if os.path.isfile(existing_path) and self.verify_file(
+                mod_element, existing_path
+            ):
+                link_or_copy(existing_path, download_filepath)
+                return True
+
+        if self.cache is not None:
+            cached_path = self.cache.fetch(
+                mod_element.project_id,
+                mod_element.file_id,
+                mod_element.filename,
+                direct_url,
+                self.deadline,
+                transfer,
+            )
+            if cached_path is None:
+                return False
+
+            if not self.verify_file(mod_element, cached_path):
+                self.cache.evict(mod_element.project_id, mod_element.file_id)
+                return False
+
+            link_or_copy(cached_path, download_filepath)
+            return True
+
+        tmp_path = temp_path(download_filepath)
+
+        try:
+            if direct_url is not None:
+                success = download_file(
+                    direct_url, tmp_path, self.deadline, transfer
+                )
+            else:
+                success = download_mod(
+                    mod_element.filename,
+                    tmp_path,
+                    mod_element.project_id,
+                    mod_element.file_id,
+                    self.deadline,
+                    transfer,
+                )
+
+            success = success and self.verify_file(mod_element, tmp_path)
+            if success:
+                os.replace(tmp_path, download_filepath)
+            return success
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def verify_file(self, mod_element: ModElement, path: str) -> bool:
+        """Checks a downloaded file against the size and hashes of the mod, if they are known.
+
+        Args:
+            mod_element (ModElement): The mod
+            path (str): The downloaded file
+
+        Returns:
+            bool: True if the file matches (or if there is nothing to check), False otherwise.
+        """
+        if mod_element.size is not None and os.path.getsize(path) != mod_element.size:
+            return False
+
+        if not mod_element.hashes:
+            return True
+
+        return file_hashes(path, mod_element.hashes.keys()) == mod_element.hashes
+
     def generate_download_url(self, mod_index: int) -> None:
         """Generates the direct download url for the mod indicated by the index.
 
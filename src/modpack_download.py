@@ -1,22 +1,63 @@
-from typing import List
+from typing import Callable, Dict, List
 from print_color import print
 import os
+import json
 import sys
-import time
+import threading
 import concurrent.futures
 
 from modpack import Modpack
-from utils import extract_zip_subfolder, print_progress
-from mod import ModType, mod_type_names_map, mod_type_color_map
-from download_list import ask_download_list
+from cache import ArtifactCache
+from utils import extract_zip_subfolder, print_progress, temp_path
+from mod import ModElement, ModType, mod_type_names_map, mod_type_color_map
+from lockfile import load_lockfile, write_lockfile
+from failures import failures_path, load_failures, write_failures
+from fallback import FALLBACK_SOURCES, fallback_download
 
 
 NUM_RETRIES = 5  # Maximum number of download retires
-RETRY_DELAY = 2  # Delay between retries in seconds
+RETRY_DELAY = 2  # Delay before the first retry in seconds, doubled at each one
+RETRY_MAX_DELAY = 30  # Maximum delay between retries in seconds
+DOWNLOAD_THREADS = (os.cpu_count() or 1) * 5  # Concurrent downloads
+HEDGE_CHECK_INTERVAL = 1  # Seconds between the checks for downloads to hedge
+SUBMIT_WINDOW_FACTOR = 2  # Mods queued at a time, per download thread
+# The hedge requests run on their own threads, so they dont wait behind the queued mods
+HEDGE_THREADS = 4
 
 README_NAME = "MODPACK_DOWNLOAD_README.txt"
 
 
+def retry_delay(attempt: int) -> float:
+    """Gets how long to wait before retrying a download, growing exponentially with the attempts.
+
+    Args:
+        attempt (int): The number of the failed attempt, starting from 0
+
+    Returns:
+        float: The delay in seconds
+    """
+    return min(RETRY_DELAY * 2**attempt, RETRY_MAX_DELAY)
+
+
+def wait_retry(modpack: Modpack, attempt: int) -> bool:
+    """Waits before retrying a download, without going past the modpack's deadline.
+
+    Args:
+        modpack (Modpack): The Modpack instance
+        attempt (int): The number of the failed attempt, starting from 0
+
+    Returns:
+        bool: True if the download can be retried, False if the deadline has been reached or the modpack stopped
+    """
+    delay = retry_delay(attempt)
+    time_left = modpack.time_left()
+    if time_left is not None:
+        delay = min(delay, time_left)
+
+    modpack.stopped.wait(delay)
+    return modpack.time_left() != 0
+
+
 def mod_download(modpack: Modpack, mod_index: int) -> int | None:
     """Tries to download a mod from the modpack.
 
@@ -30,124 +71,683 @@ def mod_download(modpack: Modpack, mod_index: int) -> int | None:
     try:
         exists = modpack.request_filename(mod_index)
     except:
+        modpack.failures[mod_index] = "couldnt reach CurseMaven"
         return mod_index
     if not exists:
+        modpack.failures[mod_index] = "not found on CurseMaven"
         return mod_index
 
-    for _ in range(NUM_RETRIES):
+    for attempt in range(NUM_RETRIES):
         try:
             success = modpack.download_resource(mod_index)
             if success:
+                modpack.failures.pop(mod_index, None)
+                return None
+            modpack.failures[mod_index] = "download failed"
+        except ValueError as e:  # Path outside of the output folder, retrying wont help
+            modpack.failures[mod_index] = str(e)
+            break
+        except Exception as e:
+            modpack.failures[mod_index] = f"download error: {e}"
+
+        if attempt == NUM_RETRIES - 1 or not wait_retry(modpack, attempt):
+            break
+
+    return mod_index
+
+
+def mod_prefetch(modpack: Modpack, mod_index: int) -> int | None:
+    """Tries to download a mod from the modpack only into the cache.
+
+    Args:
+        modpack (Modpack): The Modpack instance, with a cache
+        mod_index (int): The mod index
+
+    Returns:
+        int | None: None if the mod is now in the cache, otherwise the mod's index
+    """
+    for attempt in range(NUM_RETRIES):
+        try:
+            if modpack.prefetch_resource(mod_index):
                 return None
         except:
             pass
 
-        time.sleep(RETRY_DELAY)
+        if attempt == NUM_RETRIES - 1 or not wait_retry(modpack, attempt):
+            break
 
     return mod_index
 
 
-def multithreaded_download(modpack: Modpack) -> List[int]:
+class JsonlResultSink:
+    """Callback for multithreaded_download that appends each mod's result to a JSON lines file as soon as it's done,
+    so the results of interrupted runs arent lost."""
+
+    def __init__(self, modpack: Modpack, path: str):
+        self.modpack = modpack
+        self.file = open(path, "a", encoding="utf-8")
+
+    def __call__(self, mod_index: int, error: int | None) -> None:
+        mod_element = self.modpack[mod_index]
+        record = {
+            "index": mod_index,
+            "projectID": mod_element.project_id,
+            "fileID": mod_element.file_id,
+            "filename": mod_element.filename,
+            "ok": error is None,
+        }
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class DownloadMonitor:
+    """Follows the downloads of an install from another thread, used by the daemon to report its jobs' progress
+    and to cancel them. With a monitor the downloads run on its executor, shared between the jobs,
+    and the user isnt asked anything."""
+
+    def __init__(self, executor: concurrent.futures.ThreadPoolExecutor):
+        self.executor = executor
+        self.lock = threading.Lock()
+        self.modpack: Modpack | None = None
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.cancelled = False
+
+    def attach(self, modpack: Modpack) -> None:
+        """Starts following the downloads of a modpack."""
+        with self.lock:
+            self.modpack = modpack
+            self.total = len(modpack)
+            self.done = 0
+            self.failed = 0
+            if self.cancelled:
+                modpack.stop()
+
+    def __call__(self, mod_index: int, error: int | None) -> None:
+        with self.lock:
+            self.done += 1
+            if error is not None:
+                self.failed += 1
+
+    def cancel(self) -> None:
+        """Stops the running downloads, the mods not downloaded yet are reported as failed."""
+        with self.lock:
+            self.cancelled = True
+            if self.modpack is not None:
+                self.modpack.stop()
+
+
+def multithreaded_download(
+    modpack: Modpack,
+    task: Callable[[Modpack, int], int | None] = mod_download,
+    hedge: bool = True,
+    on_result: Callable[[int, int | None], None] | None = None,
+    monitor: DownloadMonitor | None = None,
+) -> List[int]:
     """Downloads concurrently all the mods in the modpack.
+    Only a bounded window of mods is queued at a time, so very big lists dont front-load memory,
+    and on Ctrl+C the running downloads are cancelled before the KeyboardInterrupt is raised again.
 
     Args:
         modpack (Modpack): The Modpack instance
+        task (Callable[[Modpack, int], int | None], optional): The function run for each mod,
+            returning None on success or the mod's index on failure. Defaults to mod_download.
+        hedge (bool, optional): Whether to start a second request for the slowest downloads
+            (see Modpack.stragglers), keeping the first one that finishes. Defaults to True.
+        on_result (Callable[[int, int | None], None] | None, optional): Called with the mod index and
+            the task's result as soon as each mod is done (see JsonlResultSink). Defaults to None.
+        monitor (DownloadMonitor | None, optional): Reports the progress instead of the progress bar,
+            and gives the executor to run the downloads on. Defaults to None.
 
     Returns:
-        List[int]: A list containing the indices of each mod that failed the download
+        List[int]: A list containing the indices of each mod that failed the download,
+            including the ones that didnt finish before the modpack's deadline
     """
     error_list: List[int] = []
 
-    max_workers = (os.cpu_count() or 1) * 5
+    max_workers = DOWNLOAD_THREADS
+    window = max_workers * SUBMIT_WINDOW_FACTOR
     progress_idx = 0
     modpack_len = len(modpack)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        submits = [
-            executor.submit(mod_download, modpack, idx) for idx, _ in enumerate(modpack)
-        ]
+    next_idx = 0
+    pending: Dict[concurrent.futures.Future, int] = {}
+    hedges: Dict[concurrent.futures.Future, ModElement] = {}
+
+    if monitor is not None:
+        monitor.attach(modpack)
+        executor = monitor.executor
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
 
-        for completed in concurrent.futures.as_completed(submits):
-            eventual_error: int | None = completed.result()
-            if eventual_error is not None:
-                error_list.append(eventual_error)
+    hedge_executor: concurrent.futures.ThreadPoolExecutor | None = None
+    if hedge:
+        hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=HEDGE_THREADS)
+
+    try:
+        while next_idx < modpack_len or pending:
+            while next_idx < modpack_len and len(pending) < window:
+                pending[executor.submit(task, modpack, next_idx)] = next_idx
+                next_idx += 1
 
-            progress_idx = progress_idx + 1
-            print_progress(progress_idx, modpack_len)
+            time_left = modpack.time_left()
+            if time_left == 0:
+                break
+
+            timeout = HEDGE_CHECK_INTERVAL
+            if time_left is not None:
+                timeout = min(timeout, time_left)
+
+            done, _ = concurrent.futures.wait(
+                pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+            for completed in done:
+                mod_index = pending.pop(completed)
+                eventual_error: int | None = completed.result()
+                if eventual_error is not None:
+                    error_list.append(eventual_error)
+                if on_result is not None:
+                    on_result(mod_index, eventual_error)
+
+                if monitor is not None:
+                    monitor(mod_index, eventual_error)
+                else:
+                    progress_idx = progress_idx + 1
+                    print_progress(progress_idx, modpack_len)
+
+            if hedge_executor is not None:
+                queue_drained = next_idx == modpack_len and len(pending) <= max_workers
+                for mod_element in modpack.stragglers(queue_drained):
+                    hedge_future = hedge_executor.submit(
+                        modpack.hedge_resource, mod_element
+                    )
+                    hedges[hedge_future] = mod_element
+                hedges = {
+                    future: element
+                    for future, element in hedges.items()
+                    if not future.done()
+                }
+
+        if pending or next_idx < modpack_len:
+            # The running downloads see the deadline and stop by themselves
+            unfinished = list(pending.values()) + list(range(next_idx, modpack_len))
+            error_list.extend(unfinished)
+
+            print()
+            print(
+                f"{len(unfinished)} downloads didnt finish in time",
+                tag="Deadline reached",
+                tag_color="r",
+                color="r",
+            )
+    except KeyboardInterrupt:
+        modpack.stop()
+        raise
+    finally:
+        if monitor is None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        else:  # The executor is shared, only this modpack's queued mods are cancelled
+            for future in pending:
+                future.cancel()
+
+        # No hedge can write to the folder after this returns
+        if hedge_executor is not None:
+            for future, mod_element in hedges.items():
+                if not future.cancel():
+                    modpack.cancel_transfers(mod_element)
+            hedge_executor.shutdown(wait=True, cancel_futures=True)
 
     return error_list
 
 
-def extract_modpack(modpack_path: str, extraction_path: str) -> Modpack | None:
-    """Extracts the modpack to the given folder.
+def cache_coverage(modpack: Modpack) -> int:
+    """Counts how many of the modpack's files are already in the cache.
 
     Args:
-        modpack_path (str): The path to the modpack's ZIP file
-        extraction_path (str): The path to the folder where the modpack will be extracted to
+        modpack (Modpack): The Modpack instance, with a cache
+
+    Returns:
+        int: The number of cached files
     """
-    modpack = Modpack(modpack_path, extraction_path)
+    assert modpack.cache is not None
+    return sum(
+        modpack.cache.artifact_path(mod.project_id, mod.file_id) is not None
+        for mod in modpack
+    )
 
-    if not modpack.load_modpack():
+
+def run_downloads(
+    modpack: Modpack,
+    task: Callable[[Modpack, int], int | None] = mod_download,
+    hedge: bool = True,
+    results_path: str | None = None,
+    monitor: DownloadMonitor | None = None,
+    on_result: Callable[[int, int | None], None] | None = None,
+) -> List[int]:
+    """Runs multithreaded_download, streaming the results to a JSON lines file if a path is given.
+
+    Args:
+        modpack (Modpack): The Modpack instance
+        task (Callable[[Modpack, int], int | None], optional): The function run for each mod. Defaults to mod_download.
+        hedge (bool, optional): Whether to hedge the slowest downloads. Defaults to True.
+        results_path (str | None, optional): JSON lines file to append each mod's result to. Defaults to None.
+        monitor (DownloadMonitor | None, optional): Reports the progress and runs the downloads. Defaults to None.
+        on_result (Callable[[int, int | None], None] | None, optional): Also called with each mod's result,
+            like ArchiveExporter. Defaults to None.
+
+    Returns:
+        List[int]: A list containing the indices of each mod that failed the download
+    """
+    if results_path is None:
+        return multithreaded_download(modpack, task, hedge, on_result, monitor)
+
+    sink = JsonlResultSink(modpack, results_path)
+
+    def both(mod_index: int, error: int | None) -> None:
+        sink(mod_index, error)
+        if on_result is not None:
+            on_result(mod_index, error)
+
+    try:
+        return multithreaded_download(modpack, task, hedge, both, monitor)
+    finally:
+        sink.close()
+
+
+def prefetch_modpack(
+    modpack_path: str,
+    cache: ArtifactCache,
+    results_path: str | None = None,
+    monitor: DownloadMonitor | None = None,
+) -> Modpack | None:
+    """Downloads all the modpack's files into the cache without installing them,
+    so that a later extract_modpack with the same cache doesnt need to download anything.
+
+    Args:
+        modpack_path (str): The path to the modpack's ZIP file or to its manifest.json
+        cache (ArtifactCache): The cache to fill
+        results_path (str | None, optional): JSON lines file to append each mod's result to. Defaults to None.
+        monitor (DownloadMonitor | None, optional): Reports the progress, used by the daemon. Defaults to None.
+    """
+    modpack = Modpack(modpack_path, "", cache)
+
+    if not modpack.load_modpack(create_folders=False):
         print("Error loading the modpack", tag="Error", tag_color="r", color="r")
         return
 
-    print("Downloading mods", color="c", format="bold")
-    error_indices = multithreaded_download(modpack)
+    total = len(modpack)
+    already_cached = cache_coverage(modpack)
+    print(f"{already_cached}/{total}", tag="Already cached", color="w", tag_color="c")
+
+    print("Prefetching mods", color="c", format="bold")
+    error_indices = run_downloads(modpack, mod_prefetch, False, results_path, monitor)
 
     print()
-    print("Download finished", color="g", format="bold")
-    if error_indices:
-        total = len(modpack)
-        failed = len(error_indices)
-        err_percent = failed / total * 100
+    cached = cache_coverage(modpack)
+    print(
+        f"{cached}/{total} ({cached / max(total, 1) * 100:.1f}%)",
+        tag="Cache coverage",
+        color="g" if not error_indices else "y",
+        tag_color="c",
+    )
 
-        print(
-            f"Errors downloading {failed} resources out of {total} "
-            f"({err_percent:.1f}%):",
-            color="r",
+    for error_idx in error_indices:
+        mod_element = modpack[error_idx]
+        name_str: str = (
+            mod_element.view_name or f"{mod_element.project_id}:{mod_element.file_id}"
         )
+        print(" " + name_str, tag="Not cached", tag_color="r", color="w")
 
-        for error_idx in error_indices:
-            mod_element = modpack[error_idx]
-            name_str: str = (
-                mod_element.view_name
-                or f"{mod_element.project_id}:{mod_element.file_id}"
-            )
+    return modpack
 
-            tag_str = mod_type_names_map[mod_element.file_type]
-            tag_col = mod_type_color_map[mod_element.file_type]
 
-            sys.stdout.write("    ")
-            sys.stdout.flush()
-            print(" " + name_str, tag=tag_str, tag_color=tag_col, color="w")
+def run_fallback(
+    modpack: Modpack,
+    error_indices: List[int],
+    monitor: DownloadMonitor | None = None,
+) -> List[int]:
+    """Tries the fallback sources (see fallback.py) for the mods that couldnt be downloaded,
+    so that only the ones still missing need to be downloaded manually.
 
-        not_all_undefined = any([mod.file_type != ModType.DEFAULT for mod in modpack])
-        if not_all_undefined:
-            ask_download_list(modpack, error_indices)
+    Args:
+        modpack (Modpack): The Modpack instance, after downloading the mods
+        error_indices (List[int]): The indices of the mods that couldnt be downloaded
+        monitor (DownloadMonitor | None, optional): The monitor of the downloads, whose executor
+            runs the fallback downloads too. Defaults to None, to print the progress bar.
 
-    if modpack.overrides is not None:
-        print()
-        print("Extracting overrides", color="c", format="bold")
-        extract_zip_subfolder(
-            zip_path=modpack_path, subfolder=modpack.overrides, dest_dir=extraction_path
-        )
-        print("Overrides extracted", color="g", format="bold")
+    Returns:
+        List[int]: The indices of the mods still missing
+    """
+    if not error_indices or not FALLBACK_SOURCES or modpack.time_left() == 0:
+        return error_indices
+
+    print()
+    print(
+        f"Trying the fallback sources for {len(error_indices)} resources",
+        color="c",
+        format="bold",
+    )
+    still_failed = fallback_download(
+        modpack,
+        error_indices,
+        None,
+        monitor is None,
+        monitor.executor if monitor is not None else None,
+    )
+
+    print()
+    print(
+        f"{len(error_indices) - len(still_failed)}/{len(error_indices)}",
+        tag="Found in the fallback sources",
+        color="w",
+        tag_color="c",
+    )
+    return still_failed
+
+
+def modpack_readme(modpack: Modpack) -> str:
+    """Gets the content of the readme written next to the installed modpack.
+
+    Args:
+        modpack (Modpack): The loaded Modpack instance
 
+    Returns:
+        str: The readme text
+    """
     modpack_description = f"{modpack.modpack_name} - {modpack.modpack_version}"
     if modpack.modpack_author:
         modpack_description += f" by {modpack.modpack_author}"
 
-    readme_path = os.path.join(extraction_path, README_NAME)
-    readme_contents = (
+    return (
         f"{modpack_description}\n\n"
         f"Minecraft {modpack.minecraft_version}\n"
         f"Total resources (mods, resourcepacks and shaders): {len(modpack.mods)}"
     )
 
-    with open(readme_path, "w") as readme_file:
-        readme_file.write(readme_contents)
+
+def report_errors(
+    modpack: Modpack, error_indices: List[int], interactive: bool = True
+) -> None:
+    """Prints the mods that couldnt be downloaded, and offers the page to download them manually.
+
+    Args:
+        modpack (Modpack): The Modpack instance, after downloading the mods
+        error_indices (List[int]): The indices of the mods that couldnt be downloaded
+        interactive (bool, optional): Whether to ask the user about the page. Defaults to True.
+    """
+    if not error_indices:
+        return
+
+    total = len(modpack)
+    failed = len(error_indices)
+    err_percent = failed / total * 100
+
+    print(
+        f"Errors downloading {failed} resources out of {total} "
+        f"({err_percent:.1f}%):",
+        color="r",
+    )
+
+    for error_idx in error_indices:
+        mod_element = modpack[error_idx]
+        name_str: str = (
+            mod_element.view_name or f"{mod_element.project_id}:{mod_element.file_id}"
+        )
+
+        tag_str = mod_type_names_map[mod_element.file_type]
+        tag_col = mod_type_color_map[mod_element.file_type]
+
+        sys.stdout.write("    ")
+        sys.stdout.flush()
+        print(" " + name_str, tag=tag_str, tag_color=tag_col, color="w")
+
+    if os.path.exists(failures_path(modpack.output_path)):
+        print(
+            failures_path(modpack.output_path),
+            tag="Failed mods saved, run the retry command to download only them",
+            color="w",
+            tag_color="y",
+        )
+
+    not_all_undefined = any([mod.file_type != ModType.DEFAULT for mod in modpack])
+    if interactive and not_all_undefined:
+        from download_list import ask_download_list  # Loads the templating library
+
+        ask_download_list(modpack, error_indices)
+
+
+def export_modpack(
+    modpack_path: str,
+    export_path: str,
+    cache: ArtifactCache,
+    side: str = "client",
+    results_path: str | None = None,
+    monitor: DownloadMonitor | None = None,
+) -> Modpack | None:
+    """Writes the modpack, installed, straight into an archive without writing the instance folder.
+    The mods are downloaded into the cache and added to the archive from there as soon as they are ready.
+
+    Args:
+        modpack_path (str): The path to the modpack's ZIP or .mrpack file
+        export_path (str): The archive to write, its extension chooses the format (see export.ARCHIVE_FORMATS)
+        cache (ArtifactCache): The cache to download the mods into
+        side (str, optional): "client" or "server", the side to export Modrinth modpacks for. Defaults to "client".
+        results_path (str | None, optional): JSON lines file to append each mod's result to. Defaults to None.
+        monitor (DownloadMonitor | None, optional): Reports the progress, used by the daemon. Defaults to None.
+
+    Returns:
+        Modpack | None: The Modpack instance, or None if it couldnt be loaded or some mods couldnt be downloaded
+    """
+    from export import ArchiveExporter  # Loads the compression libraries
+
+    modpack = Modpack(modpack_path, "", cache, side)
+
+    if not modpack.load_modpack(create_folders=False):
+        print("Error loading the modpack", tag="Error", tag_color="r", color="r")
+        return
+
+    exporter = ArchiveExporter(modpack, export_path, from_cache=True)
+    try:
+        print("Downloading mods", color="c", format="bold")
+        error_indices = run_downloads(
+            modpack, mod_prefetch, False, results_path, monitor, exporter
+        )
+
+        print()
+        print("Download finished", color="g", format="bold")
+        report_errors(modpack, error_indices, False)
+
+        # An archive missing some mods would look like a complete one once shipped
+        if error_indices:
+            exporter.abort()
+            print()
+            print(
+                f"Archive not written, {len(error_indices)} resources are missing",
+                tag="Error",
+                tag_color="r",
+                color="r",
+            )
+            return
+
+        exporter.add_overrides()
+        exporter.add_bytes(README_NAME, modpack_readme(modpack).encode("utf-8"))
+        exporter.close()
+    except:
+        exporter.abort()
+        raise
+
+    print()
+    print(export_path, tag="Archive written", color="w", tag_color="c")
+
+    return modpack
+
+
+def extract_modpack(
+    modpack_path: str,
+    extraction_path: str,
+    cache: ArtifactCache | None = None,
+    lock_path: str | None = None,
+    write_lock_path: str | None = None,
+    deadline: float | None = None,
+    hedge: bool = True,
+    side: str = "client",
+    reuse_path: str | None = None,
+    results_path: str | None = None,
+    monitor: DownloadMonitor | None = None,
+    export_path: str | None = None,
+) -> Modpack | None:
+    """Extracts the modpack to the given folder.
+
+    Args:
+        modpack_path (str): The path to the modpack's ZIP or .mrpack file
+        extraction_path (str): The path to the folder where the modpack will be extracted to
+        cache (ArtifactCache | None, optional): Cache to take the files from and to fill. Defaults to None.
+        lock_path (str | None, optional): Lockfile to take the already resolved files from. Defaults to None.
+        write_lock_path (str | None, optional): Where to write the lockfile of this install. Defaults to None.
+        deadline (float | None, optional): Time budget in seconds for the downloads, after which the install
+            continues with the mods downloaded until then. Defaults to None.
+        hedge (bool, optional): Whether to hedge the slowest downloads with a second request. Defaults to True.
+        side (str, optional): "client" or "server", the side to install Modrinth modpacks for. Defaults to "client".
+        reuse_path (str | None, optional): Existing instance to hardlink the unchanged files from,
+            used when extracting into a staging folder. Defaults to None.
+        results_path (str | None, optional): JSON lines file to append each mod's result to as soon as its done. Defaults to None.
+        monitor (DownloadMonitor | None, optional): Reports the progress and makes the install non interactive,
+            used by the daemon. Defaults to None.
+        export_path (str | None, optional): Archive to also write the installed files to, while they are
+            downloaded (see ArchiveExporter). Defaults to None.
+    """
+    modpack = Modpack(modpack_path, extraction_path, cache, side)
+    modpack.reuse_path = reuse_path
+
+    if not modpack.load_modpack():
+        print("Error loading the modpack", tag="Error", tag_color="r", color="r")
+        return
+
+    if lock_path is not None and not load_lockfile(modpack, lock_path):
+        print("Error loading the lockfile", tag="Error", tag_color="r", color="r")
+        return
+
+    exporter = None
+    if export_path is not None:
+        from export import ArchiveExporter  # Loads the compression libraries
+
+        exporter = ArchiveExporter(modpack, export_path)
+
+    try:
+        print("Downloading mods", color="c", format="bold")
+        modpack.set_deadline(deadline)
+        error_indices = run_downloads(
+            modpack, mod_download, hedge, results_path, monitor, exporter
+        )
+        still_failed = run_fallback(modpack, error_indices, monitor)
+        if exporter is not None:
+            for found_index in set(error_indices) - set(still_failed):
+                exporter(found_index, None)
+        error_indices = still_failed
+
+        print()
+        print("Download finished", color="g", format="bold")
+        write_failures(modpack, error_indices)
+        report_errors(modpack, error_indices, monitor is None)
+
+        if write_lock_path is not None:
+            write_lockfile(modpack, write_lock_path, error_indices)
+            print()
+            print(write_lock_path, tag="Lockfile written", color="w", tag_color="c")
+
+        if modpack.overrides:
+            print()
+            print("Extracting overrides", color="c", format="bold")
+            for overrides in modpack.overrides:
+                extract_zip_subfolder(
+                    zip_path=modpack_path, subfolder=overrides, dest_dir=extraction_path
+                )
+            print("Overrides extracted", color="g", format="bold")
+
+        readme_path = os.path.join(extraction_path, README_NAME)
+        readme_contents = modpack_readme(modpack)
+
+        tmp_readme_path = temp_path(readme_path)
+        with open(tmp_readme_path, "w") as readme_file:
+            readme_file.write(readme_contents)
+        os.replace(tmp_readme_path, readme_path)
+
+        if exporter is not None and error_indices:
+            # The instance can be completed with the retry command, the archive couldnt
+            exporter.abort()
+            print()
+            print(
+                "Archive not written, some resources are missing",
+                tag="Error",
+                tag_color="r",
+                color="r",
+            )
+        elif exporter is not None:
+            exporter.add_overrides()
+            exporter.add_bytes(README_NAME, readme_contents.encode("utf-8"))
+            exporter.close()
+            print()
+            print(export_path, tag="Archive written", color="w", tag_color="c")
+    except:
+        if exporter is not None:
+            exporter.abort()
+        raise
 
     print()
     print("Modpack successfully downloaded", color="g", format="bold")
 
     return modpack
+
+
+def retry_failed(
+    extraction_path: str,
+    cache: ArtifactCache | None = None,
+    deadline: float | None = None,
+    hedge: bool = True,
+    results_path: str | None = None,
+    monitor: DownloadMonitor | None = None,
+) -> Modpack | None:
+    """Downloads again only the mods that failed in the last install into the folder,
+    taken from the failed mods list saved there, without touching the rest of the instance.
+
+    Args:
+        extraction_path (str): The instance folder
+        cache (ArtifactCache | None, optional): Cache to take the files from and to fill. Defaults to None.
+        deadline (float | None, optional): Time budget in seconds for the downloads. Defaults to None.
+        hedge (bool, optional): Whether to hedge the slowest downloads with a second request. Defaults to True.
+        results_path (str | None, optional): JSON lines file to append each mod's result to as soon as its done. Defaults to None.
+        monitor (DownloadMonitor | None, optional): Reports the progress and makes the retry non interactive,
+            used by the daemon. Defaults to None.
+
+    Returns:
+        Modpack | None: The Modpack instance with the retried mods, or None if there is nothing to retry
+    """
+    modpack = Modpack("", extraction_path, cache)
+
+    if not load_failures(modpack):
+        print(
+            "No failed mods list in this folder", tag="Error", tag_color="r", color="r"
+        )
+        return
+
+    print(str(len(modpack)), tag="Mods to retry", color="w", tag_color="c")
+    print("Downloading mods", color="c", format="bold")
+    modpack.set_deadline(deadline)
+    error_indices = run_downloads(modpack, mod_download, hedge, results_path, monitor)
+    error_indices = run_fallback(modpack, error_indices, monitor)
+
+    print()
+    print("Download finished", color="g", format="bold")
+    write_failures(modpack, error_indices)
+    report_errors(modpack, error_indices, monitor is None)
+
+    if not error_indices:
+        print()
+        print("All the failed mods have been downloaded", color="g", format="bold")
+
+    return modpack
@@ -0,0 +1,130 @@
+from typing import Dict, List
+import ntpath
+import posixpath
+import json
+
+from utils import load_file_from_zip
+from mod import ModElement, ModType
+
+MODRINTH_INDEX_FILE = "modrinth.index.json"
+MODRINTH_PROJECT = "modrinth"  # Used as project id of the files, that are identified by their sha1 instead
+OVERRIDES_FOLDER = "overrides"
+SIDE_OVERRIDES_FOLDERS: Dict[str, str] = {
+    "client": "client-overrides",
+    "server": "server-overrides",
+}
+
+# Dependency names in the index -> loader names as used in the CurseForge manifests
+loader_names_map: Dict[str, str] = {
+    "forge": "forge",
+    "neoforge": "neoforge",
+    "fabric-loader": "fabric",
+    "quilt-loader": "quilt",
+}
+
+folder_type_map: Dict[str, ModType] = {
+    "mods": ModType.MOD,
+    "resourcepacks": ModType.RESOURCEPACK,
+    "shaderpacks": ModType.SHADERPACK,
+}
+
+
+def load_mrpack_index(modpack_path: str) -> Dict:
+    """Loads the index of a Modrinth modpack.
+
+    Args:
+        modpack_path (str): The path to the pack's .mrpack file
+
+    Returns:
+        Dict: The modrinth.index.json file loaded as a Python dict
+    """
+    json_bytes = load_file_from_zip(modpack_path, MODRINTH_INDEX_FILE)
+    return json.loads(json_bytes.decode("utf-8"))
+
+
+def get_mrpack_minecraft_version(index: Dict) -> str:
+    """Gets the minecraft version for the given Modrinth index dict
+
+    Args:
+        index (Dict): The modrinth.index.json file loaded as a Python dict
+
+    Returns:
+        str: The minecraft version as "version - loader id", like for CurseForge modpacks
+    """
+    dependencies: Dict[str, str] = index.get("dependencies", {})
+    version = dependencies.get("minecraft", "")
+    if not version:
+        return ""
+
+    id = ""
+    for dependency, loader in loader_names_map.items():
+        if dependency in dependencies:
+            id = f"{loader}-{dependencies[dependency]}"
+
+    return f"{version} - {id}"
+
+
+def is_safe_path(path: str) -> bool:
+    """Checks that a file path of the index stays inside the output folder on every OS.
+    The paths must use / separators, so backslashes, drive letters and .. parts are all refused.
+
+    Args:
+        path (str): The path of a file in the index
+
+    Returns:
+        bool: True if the path is relative and inside the output folder, False otherwise
+    """
+    if not path or "\\" in path or ntpath.splitdrive(path)[0]:
+        return False
+
+    parts = path.split("/")
+    if path.startswith("/") or ".." in parts:
+        return False
+
+    return posixpath.normpath(path) not in [".", ""] and parts[-1] not in ["", "."]
+
+
+def mrpack_mod_elements(index: Dict, side: str) -> List[ModElement]:
+    """Creates the mod elements for the files of a Modrinth modpack.
+    The index already contains urls, sizes and hashes, so the elements are ready to be downloaded and verified.
+
+    Args:
+        index (Dict): The modrinth.index.json file loaded as a Python dict
+        side (str): "client" or "server", the files unsupported on this side are skipped
+
+    Returns:
+        List[ModElement]: The mod elements
+    """
+    mods: List[ModElement] = []
+
+    for file in index.get("files", []):
+        path: str = file.get("path", "")
+        hashes: Dict[str, str] = file.get("hashes", {})
+        urls: List[str] = file.get("downloads", [])
+
+        if file.get("env", {}).get(side) == "unsupported":
+            continue
+
+        # Dont let the pack write outside of the output folder
+        if not urls or "sha1" not in hashes or not is_safe_path(path):
+            continue
+
+        folder, filename = posixpath.split(posixpath.normpath(path))
+
+        mod_element = ModElement(MODRINTH_PROJECT, hashes["sha1"])
+        mod_element.filename = filename
+        mod_element.view_name = filename
+        mod_element.target_folder = folder
+        mod_element.file_type = folder_type_map.get(folder, ModType.DEFAULT)
+        mod_element.cdn_url = urls[0]
+        mod_element.direct_urls = urls
+        mod_element.download_url = urls[0]  # For the manual download page
+        mod_element.size = file.get("fileSize")
+        mod_element.hashes = {
+            algorithm: hashes[algorithm]
+            for algorithm in ("sha1", "sha512")
+            if algorithm in hashes
+        }
+        mods.append(mod_element)
+
+    return mods
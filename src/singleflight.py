@@ -0,0 +1,44 @@
+from typing import Any, Callable, Dict, Hashable
+from concurrent.futures import Future
+import threading
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key, so that only one of them actually runs
+    and all the others wait for it and get its result (or its exception)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Runs fn(*args, **kwargs), unless a call with the same key is already running.
+        In that case waits for the running call and returns its result.
+
+        Args:
+            key (Hashable): The key that identifies the operation
+            fn (Callable[..., Any]): The function to run
+
+        Returns:
+            Any: The result of fn
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if call is None:
+                call = Future()
+                self._calls[key] = call
+
+        if not is_leader:
+            return call.result()
+
+        try:
+            result = fn(*args, **kwargs)
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -0,0 +1,231 @@
+from typing import Callable, Dict, List, Set
+from print_color import print
+import os
+import json
+import shutil
+
+from utils import copy_file, exchange_paths, temp_path
+from failures import FAILED_MODS_FILE
+from locks import FileLock
+
+STAGING_SUFFIX = ".staging"
+PREVIOUS_SUFFIX = ".previous"
+ROLLBACK_SUFFIX = ".rollback"
+LOCK_SUFFIX = ".lock"
+# Files carried over into the staging folder, with the size and modification time they had in the live instance
+CARRIED_FILE = ".carried_over.json"
+
+# Folders whose content is entirely managed by the modpack, so they are never carried over from the live instance
+MANAGED_FOLDERS: List[str] = ["mods", "resourcepacks", "shaderpacks"]
+# Files written by each install, that are stale in the live instance
+MANAGED_FILES: List[str] = [FAILED_MODS_FILE, CARRIED_FILE]
+
+
+def staging_path(live_path: str) -> str:
+    """Gets the staging folder of an instance, a sibling of it so that it can be renamed into its place."""
+    return os.path.normpath(os.path.abspath(live_path)) + STAGING_SUFFIX
+
+
+def previous_path(live_path: str) -> str:
+    """Gets the folder where the previous version of an instance is kept after a swap, for rollbacks."""
+    return os.path.normpath(os.path.abspath(live_path)) + PREVIOUS_SUFFIX
+
+
+def instance_lock(live_path: str) -> FileLock:
+    """Gets the lock of an instance folder, held while installing, retrying, swapping or rolling it back,
+    so that more installers running at once never write to the same folder.
+    Its a sibling file like the staging folder, so it stays in place when the folders are swapped."""
+    return FileLock(os.path.normpath(os.path.abspath(live_path)) + LOCK_SUFFIX)
+
+
+def wait_instance_lock(
+    live_path: str, should_stop: Callable[[], bool] | None = None
+) -> FileLock | None:
+    """Takes the lock of an instance folder, waiting for the other process using it to finish.
+
+    Args:
+        live_path (str): The instance folder
+        should_stop (Callable[[], bool] | None, optional): Checked while waiting, to give up when it returns True.
+            Defaults to None.
+
+    Returns:
+        FileLock | None: The taken lock, or None if it stopped waiting
+    """
+    lock = instance_lock(live_path)
+    if lock.acquire(blocking=False):
+        return lock
+
+    print(live_path, tag="Waiting for another install into", tag_color="y", color="w")
+    return lock if lock.acquire(should_stop=should_stop) else None
+
+
+def prepare_staging(live_path: str) -> str:
+    """Creates an empty staging folder for the instance, removing the one of an eventual previous unfinished install.
+
+    Args:
+        live_path (str): The instance folder
+
+    Returns:
+        str: The staging folder path
+    """
+    staging = staging_path(live_path)
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+    return staging
+
+
+def _load_carried(staging: str) -> Dict[str, List[int]]:
+    try:
+        with open(os.path.join(staging, CARRIED_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except:
+        return {}
+
+
+def _remove_carried(folder: str) -> None:
+    carried_path = os.path.join(folder, CARRIED_FILE)
+    if os.path.exists(carried_path):
+        os.remove(carried_path)
+
+
+def carry_over(live_path: str, staging: str) -> int:
+    """Copies into the staging folder every file of the live instance that isnt part of the modpack
+    (worlds, logs, user settings and so on), without replacing the files installed in staging.
+    Those files are copied and not hardlinked, since the game edits them in place (configs, worlds...)
+    and a hardlink would change the previous version too, breaking the rollbacks.
+    Only the files new or changed since the last call are copied, and the ones removed from the live instance
+    are removed from staging, so it's done once after staging and again at the swap just for what changed.
+
+    Args:
+        live_path (str): The instance folder
+        staging (str): The staging folder
+
+    Returns:
+        int: The number of copied files
+    """
+    carried = _load_carried(staging)
+    seen: Set[str] = set()
+    copied = 0
+
+    for root, dirs, files in os.walk(live_path):
+        relative_root = os.path.relpath(root, live_path)
+        if relative_root == ".":
+            dirs[:] = [d for d in dirs if d not in MANAGED_FOLDERS]
+            files = [f for f in files if f not in MANAGED_FILES]
+
+        for name in files:
+            relative = os.path.normpath(os.path.join(relative_root, name))
+            source = os.path.join(root, name)
+            target = os.path.join(staging, relative)
+            if relative not in carried and os.path.lexists(target):
+                continue  # The modpack's version of the file wins
+
+            try:
+                stat = os.stat(source)
+            except FileNotFoundError:
+                continue  # Removed while walking the folder
+            seen.add(relative)
+
+            signature = [stat.st_size, stat.st_mtime_ns]
+            if carried.get(relative) == signature and os.path.lexists(target):
+                continue  # Unchanged since it was copied
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            copy_file(source, target)
+            carried[relative] = signature
+            copied += 1
+
+    for relative in [relative for relative in carried if relative not in seen]:
+        target = os.path.join(staging, relative)
+        if os.path.lexists(target):
+            os.remove(target)  # Removed from the live instance
+        del carried[relative]
+
+    carried_path = os.path.join(staging, CARRIED_FILE)
+    tmp_path = temp_path(carried_path)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(carried, f)
+    os.replace(tmp_path, carried_path)
+
+    return copied
+
+
+def _rename_in_place(live: str, other: str, kept_path: str) -> None:
+    os.rename(live, kept_path)
+    try:
+        os.rename(other, live)
+    except:
+        os.rename(kept_path, live)  # Dont leave the instance missing
+        raise
+
+
+def _swap_folders(live: str, other: str, kept_path: str) -> None:
+    """Puts the other folder in place of the live one, moving the live one to kept_path.
+    On linux the two folders are exchanged atomically, elsewhere the live path is missing
+    for the moment between two renames."""
+    if exchange_paths(live, other):
+        os.rename(other, kept_path)
+    else:
+        _rename_in_place(live, other, kept_path)
+
+
+def swap_staging(live_path: str) -> bool:
+    """Puts the staged instance in place of the live one, keeping the live one as the previous version.
+    The files that arent part of the modpack changed since staging are copied again first,
+    so this should be done with the game/server stopped.
+
+    Args:
+        live_path (str): The instance folder
+
+    Returns:
+        bool: True if the staged instance is now live, False if there was nothing staged
+    """
+    live = os.path.normpath(os.path.abspath(live_path))
+    staging = staging_path(live)
+    previous = previous_path(live)
+
+    if not os.path.isdir(staging):
+        return False
+
+    if not os.path.isdir(live):
+        os.rename(staging, live)
+        _remove_carried(live)
+        return True
+
+    carry_over(live, staging)
+    _remove_carried(staging)
+
+    # The old previous version is removed after the swap, so it doesnt make it longer
+    old_previous = None
+    if os.path.exists(previous):
+        old_previous = temp_path(previous)
+        os.rename(previous, old_previous)
+
+    _swap_folders(live, staging, previous)
+
+    if old_previous is not None:
+        shutil.rmtree(old_previous)
+    return True
+
+
+def rollback(live_path: str) -> bool:
+    """Swaps the live instance with its previous version. Doing it again goes back to the newer version.
+
+    Args:
+        live_path (str): The instance folder
+
+    Returns:
+        bool: True if the previous version is now live, False if there was no previous version
+    """
+    live = os.path.normpath(os.path.abspath(live_path))
+    previous = previous_path(live)
+    rolled_back = live + ROLLBACK_SUFFIX
+
+    if not os.path.isdir(previous) or not os.path.isdir(live):
+        return False
+
+    if not exchange_paths(live, previous):
+        _rename_in_place(live, previous, rolled_back)
+        os.rename(rolled_back, previous)
+    return True
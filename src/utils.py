@@ -1,11 +1,12 @@
 from pathlib import Path
+from typing import Dict, Iterable
 import os
+import hashlib
 import sys
 import platform
-import ctypes
+import shutil
+import uuid
 import zipfile
-import tkinter as tk
-from tkinter import filedialog
 from print_color import print
 from print_color.print_color import Color as color_typing
 
@@ -15,6 +16,8 @@ def set_windows_dpi_awareness():
     Safely detects if the current platform is not windows."""
     if platform.system() == "Windows":
         try:
+            import ctypes
+
             ctypes.windll.shcore.SetProcessDpiAwareness(1)
         except:
             pass
@@ -25,7 +28,8 @@ def file_input_dialog(extension: str | None = None, folder_dialog: bool = False)
 
     Args:
         extension (str | None, optional): If folder_dialog is false, this is the
-            file extension that files will be filtered for in the file input dialog. Defaults to None.
+            file extension that files will be filtered for in the file input dialog,
+            or more space separated patterns like "*.zip *.mrpack". Defaults to None.
         folder_dialog (bool, optional): True if this is a folder input dialog, False for a file input dialog.
             For file input dialogs, extension is needed. Defaults to False.
 
@@ -35,6 +39,10 @@ def file_input_dialog(extension: str | None = None, folder_dialog: bool = False)
     if extension is None and not folder_dialog:
         return ""
 
+    # Imported here to not load the GUI libraries when the paths are given as arguments
+    import tkinter as tk
+    from tkinter import filedialog
+
     root = tk.Tk()
     root.withdraw()
 
@@ -96,8 +104,143 @@ def extract_zip_subfolder(zip_path: str, subfolder: str, dest_dir: str) -> None:
 
                 os.makedirs(target_path.parent, exist_ok=True)
 
-                with z.open(member) as source, open(target_path, "wb") as target:
+                # Replaced instead of overwritten, the old file could be hardlinked to another instance
+                tmp_path = temp_path(str(target_path))
+                with z.open(member) as source, open(tmp_path, "wb") as target:
                     target.write(source.read())
+                os.replace(tmp_path, target_path)
+
+
+def temp_path(path: str) -> str:
+    """Gets a unique hidden temporary path in the same folder of the given path,
+    to write a file there and then rename it to its final path with os.replace.
+
+    Args:
+        path (str): The final path of the file
+
+    Returns:
+        str: The temporary path, the file isnt created
+    """
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f".{name}.{uuid.uuid4().hex}.part")
+
+
+def safe_filename(filename: str) -> str | None:
+    """Gets the name of a file from a name sent by a server, that could contain a path.
+
+    Args:
+        filename (str): The received filename
+
+    Returns:
+        str | None: The last part of the name, or None if there isnt a usable one
+    """
+    filename = os.path.basename(filename.replace("\\", "/"))
+    return filename if filename not in ["", ".", ".."] else None
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Places a copy of a file at the destination path, as a hardlink if possible to avoid using more space.
+    The destination is replaced atomically, so it is never seen half written.
+
+    Args:
+        src (str): The source file
+        dst (str): The destination file path
+    """
+    tmp_path = temp_path(dst)
+
+    try:
+        try:
+            os.link(src, tmp_path)
+        except OSError:  # Different filesystem or no hardlink support
+            shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def copy_file(src: str, dst: str) -> None:
+    """Places an independent copy of a file at the destination path, keeping its metadata,
+    for files that can be changed in place later, where a hardlink would change both copies.
+    The destination is replaced atomically, so it is never seen half written.
+
+    Args:
+        src (str): The source file
+        dst (str): The destination file path
+    """
+    tmp_path = temp_path(dst)
+
+    try:
+        shutil.copy2(src, tmp_path)
+        os.replace(tmp_path, dst)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def exchange_paths(path_a: str, path_b: str) -> bool:
+    """Atomically swaps two paths, so that neither of them is ever missing.
+    Uses renameat2 with RENAME_EXCHANGE, available only on linux.
+
+    Args:
+        path_a (str): The first path
+        path_b (str): The second path, on the same filesystem
+
+    Raises:
+        OSError: If the paths cant be exchanged for another reason, like a missing path
+
+    Returns:
+        bool: True if the paths have been exchanged, False if its not supported here
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+
+    import ctypes
+    import errno
+
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):  # glibc older than 2.28, or another libc
+        return False
+    renameat2.argtypes = [
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.c_uint,
+    ]
+
+    AT_FDCWD = -100
+    RENAME_EXCHANGE = 2
+    result = renameat2(
+        AT_FDCWD, os.fsencode(path_a), AT_FDCWD, os.fsencode(path_b), RENAME_EXCHANGE
+    )
+    if result == 0:
+        return True
+
+    error = ctypes.get_errno()
+    if error in [errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP]:
+        return False  # The filesystem doesnt support it
+    raise OSError(error, os.strerror(error), path_a)
+
+
+def file_hashes(path: str, algorithms: Iterable[str]) -> Dict[str, str]:
+    """Computes the hashes of a file, reading it only once.
+
+    Args:
+        path (str): The file path
+        algorithms (Iterable[str]): The hashlib algorithm names, like "sha1" or "sha256"
+
+    Returns:
+        Dict[str, str]: The hex digest for each algorithm
+    """
+    hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            for hasher in hashers.values():
+                hasher.update(chunk)
+
+    return {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
 
 
 def print_progress(current_idx: int, total_len: int) -> None:
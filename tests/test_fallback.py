@@ -0,0 +1,139 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from cursemaven import Transfer
+from fallback import fallback_download, is_valid_download
+from modpack import Modpack
+
+
+def make_jar() -> bytes:
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as jar:
+        jar.writestr("META-INF/MANIFEST.MF", "Manifest-Version: 1.0\n")
+    return data.getvalue()
+
+
+JAR = make_jar()
+
+
+class SourceHandler(BaseHTTPRequestHandler):
+    """A fallback source sending the jar, a login page or a cut off jar, depending on the path."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        kind, project_id, file_id = self.path.strip("/").split("/")
+
+        if kind == "html":
+            body = b"<html><body>Log in to download</body></html>"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/java-archive")
+        self.send_header("Content-Length", str(len(JAR)))
+        self.send_header(
+            "Content-Disposition",
+            f'attachment; filename="found-{project_id}-{file_id}.jar"',
+        )
+        self.end_headers()
+        # The truncated one closes the connection halfway through the file
+        self.wfile.write(JAR if kind == "jar" else JAR[: len(JAR) // 2])
+
+
+class FallbackTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), SourceHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = "http://127.0.0.1:%d" % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        pack_path = os.path.join(self.folder.name, "pack.zip")
+        manifest = {
+            "minecraft": {"version": "1.20.1", "modLoaders": [{"id": "forge-47.2.0"}]},
+            "name": "Test",
+            "version": "1.0",
+            "author": "test",
+            "files": [{"projectID": 1, "fileID": 10}],
+            "overrides": "overrides",
+        }
+        with zipfile.ZipFile(pack_path, "w") as pack:
+            pack.writestr("manifest.json", json.dumps(manifest))
+
+        self.modpack = Modpack(pack_path, os.path.join(self.folder.name, "instance"))
+        self.assertTrue(self.modpack.load_modpack())
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def source(self, kind: str):
+        return lambda mod: f"{self.base_url}/{kind}/{mod.project_id}/{mod.file_id}"
+
+    def downloaded_files(self):
+        return os.listdir(self.modpack.mods_folder)
+
+    def test_uses_the_first_valid_source(self):
+        sources = [self.source("html"), self.source("truncated"), self.source("jar")]
+        still_failed = fallback_download(self.modpack, [0], sources, False)
+
+        self.assertEqual(still_failed, [])
+        self.assertEqual(self.modpack[0].filename, "found-1-10.jar")
+        with open(self.modpack.target_path(self.modpack[0]), "rb") as f:
+            self.assertEqual(f.read(), JAR)
+        self.assertEqual(self.downloaded_files(), ["found-1-10.jar"])
+
+    def test_rejects_pages_and_truncated_files(self):
+        sources = [self.source("html"), self.source("truncated")]
+        still_failed = fallback_download(self.modpack, [0], sources, False)
+
+        self.assertEqual(still_failed, [0])
+        self.assertEqual(self.downloaded_files(), [])
+        self.assertIn("not in the fallback sources", self.modpack.failures[0])
+
+    def test_is_valid_download(self):
+        path = os.path.join(self.folder.name, "download")
+        mod = self.modpack[0]
+
+        def check(content: bytes, headers: dict) -> bool:
+            with open(path, "wb") as f:
+                f.write(content)
+            transfer = Transfer()
+            transfer.headers = headers
+            return is_valid_download(self.modpack, mod, transfer, path)
+
+        jar_type = {"content-type": "application/java-archive"}
+        self.assertTrue(check(JAR, {**jar_type, "content-length": str(len(JAR))}))
+        self.assertFalse(check(JAR, {"content-type": "text/html; charset=utf-8"}))
+        self.assertFalse(check(b"<html></html>", {}))  # Not a zip, whatever the headers
+        half = JAR[: len(JAR) // 2]
+        self.assertFalse(check(half, {**jar_type, "content-length": str(len(JAR))}))
+        self.assertFalse(check(half, jar_type))  # Without the length, still not a zip
+
+        mod.size = len(JAR) + 1  # Known from a lockfile or a Modrinth pack
+        self.assertFalse(check(JAR, jar_type))
+
+
+if __name__ == "__main__":
+    unittest.main()